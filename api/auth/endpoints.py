@@ -1,8 +1,8 @@
 from datetime import timedelta
-from fastapi import APIRouter, Depends, status, HTTPException
+from fastapi import APIRouter, Depends, status, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import JSONResponse
-from sqlalchemy import select, insert, update, delete
+from sqlalchemy import select, insert, update, delete, and_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from jose import jwt, JWTError
@@ -10,7 +10,11 @@ from celery_tasks.tasks import send_email
 from config import JWT_SECRET_KEY, JWT_ALGORITHM, JWT_EXPIRE_MINUTES, JWT_EXPIRE_MINUTES_RESET_PASSWORD
 from auth.models import user as user_model
 from database import get_async_session
-from auth.utils import AuthHelper, get_current_user, private_full_email
+from replicas import get_read_session
+from auth.utils import AuthHelper, get_current_user, private_full_email, invalidate_user, get_user_by_username
+from auth.hashing import password_rehash
+from auth.rate_limit import login_limiter, reset_password_limiter, client_ip
+from crypt_password.utils import invalidate_ownership
 from auth.schemas import UserInToken, UserInfo, CreateUser, ResetPassword, NewPassword, ChangeOldPassword, UpdateUser,\
     DeleteUser
 
@@ -18,21 +22,32 @@ router = APIRouter()
 
 
 @router.post('/login', response_model=UserInToken)
-async def authenticate_user(data_auth: OAuth2PasswordRequestForm = Depends(),
+async def authenticate_user(request: Request,
+                            data_auth: OAuth2PasswordRequestForm = Depends(),
                             helper: AuthHelper = Depends(AuthHelper),
                             session: AsyncSession = Depends(get_async_session)
                             ) -> UserInToken:
-    query = select(user_model).where(user_model.c.username == data_auth.username)
-    user = await session.execute(query)
-    user = user.fetchone()
+    await login_limiter.check(user=data_auth.username.lower(), ip=client_ip(request))
+    user = await get_user_by_username(session, data_auth.username)
     if not user:
         helper.raise_auth_exception('User doesnt exist')
-    if helper.verify_password(data_auth.password, user.password) is False:
+    is_valid, new_hash = await helper.verify_and_update_password(data_auth.password, user.password)
+    if is_valid is False:
         helper.raise_auth_exception('Incorrect password')
 
     if user.is_active is False:
         helper.raise_auth_exception('User is not active')
 
+    if new_hash is not None:
+        # хэш со старой схемой/стоимостью заменяется текущим, пока известен открытый пароль
+        stmt = update(user_model) \
+            .where(and_(user_model.c.id == user.id, user_model.c.password == user.password)) \
+            .values(password=new_hash)
+        await session.execute(stmt)
+        await session.commit()
+        await invalidate_user(user.username)
+        password_rehash.inc()
+
     access_token = helper.create_access_token(
         data={'sub': user.username},
         expires_delta=timedelta(minutes=JWT_EXPIRE_MINUTES)
@@ -52,7 +67,7 @@ async def create_user(data_user: CreateUser,
                       session: AsyncSession = Depends(get_async_session),
                       auth_helper: AuthHelper = Depends(AuthHelper)) -> JSONResponse:
     data_user = data_user.dict()
-    data_user['password'] = auth_helper.hash_password(data_user.get('password'))
+    data_user['password'] = await auth_helper.hash_password(data_user.get('password'))
     try:
         stmt = insert(user_model).values(**data_user)
         await session.execute(stmt)
@@ -76,6 +91,7 @@ async def update_user(
     stmt = update(user_model).where(user_model.c.username == current_user.username).values(**update_date.dict())
     await session.execute(stmt)
     await session.commit()
+    await invalidate_user(current_user.username, update_date.dict().get('username'))
     user = dict(current_user._mapping)
     del user['password']
     user.update(update_date)
@@ -83,10 +99,8 @@ async def update_user(
 
 
 @router.get('/{username}/', response_model=UserInfo)
-async def get_info(username: str, session: AsyncSession = Depends(get_async_session)) -> UserInfo:
-    query = select(user_model).where(user_model.c.username == username)
-    user = await session.execute(query)
-    user = user.fetchone()
+async def get_info(username: str, session: AsyncSession = Depends(get_read_session)) -> UserInfo:
+    user = await get_user_by_username(session, username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -96,8 +110,9 @@ async def get_info(username: str, session: AsyncSession = Depends(get_async_sess
 
 
 @router.post('/reset_password/')
-async def request_reset_password(login_data: ResetPassword, helper: AuthHelper = Depends(AuthHelper),
+async def request_reset_password(request: Request, login_data: ResetPassword, helper: AuthHelper = Depends(AuthHelper),
                                  session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
+    await reset_password_limiter.check(user=(login_data.email or login_data.username).lower(), ip=client_ip(request))
     if login_data.email:
         query = select(user_model.c.email, user_model.c.username,
                        user_model.c.is_active).where(user_model.c.email == login_data.email)
@@ -145,10 +160,11 @@ async def recovery_by_token(token: str, new_password: NewPassword, helper: AuthH
                 content={'detail': f'No found data username by token.'},
                 status_code=status.HTTP_404_NOT_FOUND,
             )
-        password = helper.hash_password(new_password.new_password)
+        password = await helper.hash_password(new_password.new_password)
         stmt = update(user_model).where(user_model.c.username == username).values(password=password)
         await session.execute(stmt)
         await session.commit()
+        await invalidate_user(username)
         return JSONResponse(
             content={'message': f'Password by username ({username}) successfully updated.'},
             status_code=status.HTTP_200_OK,
@@ -164,15 +180,16 @@ async def recovery_by_token(token: str, new_password: NewPassword, helper: AuthH
 async def change_password(data_passwords: ChangeOldPassword, helper: AuthHelper = Depends(AuthHelper),
                           current_user: user_model = Depends(get_current_user),
                           session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    if not helper.verify_password(data_passwords.old_password, current_user.password):
+    if not await helper.verify_password(data_passwords.old_password, current_user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid old password!',
         )
-    stmt = update(user_model).where(user_model.c.name == current_user.username).values(
-        password=data_passwords.new_password)
+    password = await helper.hash_password(data_passwords.new_password)
+    stmt = update(user_model).where(user_model.c.username == current_user.username).values(password=password)
     await session.execute(stmt)
     await session.commit()
+    await invalidate_user(current_user.username)
     return JSONResponse(
         content={'message': f'Password by username ({current_user.username}) successfully updated.'},
         status_code=status.HTTP_200_OK,
@@ -183,7 +200,7 @@ async def change_password(data_passwords: ChangeOldPassword, helper: AuthHelper
 async def delete_user(password_schemas: DeleteUser, helper: AuthHelper = Depends(AuthHelper),
                       current_user: user_model = Depends(get_current_user),
                       session: AsyncSession = Depends(get_async_session)) -> JSONResponse:
-    if not helper.verify_password(password_schemas.password, current_user.password):
+    if not await helper.verify_password(password_schemas.password, current_user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Invalid old password!',
@@ -191,6 +208,8 @@ async def delete_user(password_schemas: DeleteUser, helper: AuthHelper = Depends
     stmt = delete(user_model).where(user_model.c.username == current_user.username)
     await session.execute(stmt)
     await session.commit()
+    await invalidate_user(current_user.username)
+    await invalidate_ownership(current_user.id)
     return JSONResponse(
         content={'message': f'Username ({current_user.username}) deleted.'},
         status_code=status.HTTP_200_OK,
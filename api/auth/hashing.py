@@ -0,0 +1,91 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from prometheus_client import Histogram, Counter
+
+from config import HASH_WORKERS, HASH_EXECUTOR, HASH_MAX_PENDING, PASSWORD_SCHEMES, BCRYPT_ROUNDS, ARGON2_TIME_COST, \
+    ARGON2_MEMORY_COST, ARGON2_PARALLELISM
+from tracing import span
+
+SCHEME_SETTINGS = {
+    'bcrypt': {'bcrypt__rounds': BCRYPT_ROUNDS},
+    'argon2': {'argon2__time_cost': ARGON2_TIME_COST, 'argon2__memory_cost': ARGON2_MEMORY_COST,
+               'argon2__parallelism': ARGON2_PARALLELISM},
+}
+
+pwd_context = CryptContext(schemes=PASSWORD_SCHEMES, deprecated='auto',
+                           **{key: value for scheme in PASSWORD_SCHEMES for key, value in SCHEME_SETTINGS[scheme].items()})
+
+hash_duration = Histogram('password_hash_seconds', 'Time spent hashing or verifying user passwords',
+                          ['operation'])
+password_rehash = Counter('password_rehash_total', 'Password hashes upgraded to the current scheme/cost on login')
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """ Выполняет bcrypt в пуле воркеров, чтобы не блокировать event loop """
+
+    def __init__(self, workers: int, max_pending: int, executor_type: str = 'thread'):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor_type = executor_type
+        self.pending = 0
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        # пул создается лениво, уже внутри воркера gunicorn (после fork)
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+        return self._executor
+
+    async def hash(self, password: str) -> str:
+        return await self._run('hash', _hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run('verify', _verify, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """ Проверка пароля и новый хэш, если старый устарел (схема или стоимость), за одну задачу пула """
+        return await self._run('verify', _verify_and_update, plain_password, hashed_password)
+
+    async def _run(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Too many authentication requests, try again later',
+                headers={'Retry-After': '1'},
+            )
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            with span('bcrypt'):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+            hash_duration.labels(operation).observe(time.perf_counter() - start)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, executor_type=HASH_EXECUTOR)
@@ -0,0 +1,103 @@
+""" Ограничение частоты входа и сброса пароля.
+
+Token bucket на каждый ключ (имя пользователя, IP клиента) хранится в Redis и обновляется одним
+Lua скриптом: запрос проходит, только если токен есть во всех его корзинах, иначе 429 с Retry-After.
+Проверка выполняется до запроса к БД и bcrypt, поэтому перебор паролей одного аккаунта не занимает
+пул хэширования остальных пользователей. Если Redis недоступен, запросы пропускаются.
+"""
+import math
+import time
+
+from fastapi import HTTPException, Request, status
+from loguru import logger
+from prometheus_client import Counter, Histogram
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import REDIS_HOST, REDIS_PORT, RATE_LIMIT_DB, RATE_LIMIT_ENABLED, LOGIN_RATE_LIMIT_USER, \
+    LOGIN_RATE_LIMIT_IP, RESET_PASSWORD_RATE_LIMIT_USER, RESET_PASSWORD_RATE_LIMIT_IP
+
+rate_limit_requests = Counter('rate_limit_requests_total', 'Rate limiter decisions', ['limiter', 'result'])
+rate_limit_duration = Histogram('rate_limit_seconds', 'Time spent checking the rate limiter in Redis', ['limiter'])
+
+redis_rate_limit_client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=RATE_LIMIT_DB) if RATE_LIMIT_ENABLED else None
+
+
+def parse_limit(limit: str) -> tuple[int, float]:
+    """ "10/60" -> (емкость корзины, секунд на полное восполнение) """
+    capacity, period = limit.split('/')
+    return int(capacity), float(period)
+
+
+class RateLimiter:
+    """ Token bucket по нескольким ключам: время берется из Redis, общее для всех воркеров и нод """
+
+    # KEYS - корзины, ARGV - пары (емкость, период); возвращает 0 или секунды до появления токена
+    _acquire_script = """
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local tokens, retry_after = {}, 0
+    for i, key in ipairs(KEYS) do
+        local capacity, period = tonumber(ARGV[i * 2 - 1]), tonumber(ARGV[i * 2])
+        local rate = capacity / period
+        local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+        local available = tonumber(bucket[1]) or capacity
+        local updated = tonumber(bucket[2]) or now
+        available = math.min(capacity, available + math.max(now - updated, 0) * rate)
+        if available < 1 then
+            retry_after = math.max(retry_after, (1 - available) / rate)
+        end
+        tokens[i] = available
+    end
+    if retry_after > 0 then
+        return tostring(retry_after)
+    end
+    for i, key in ipairs(KEYS) do
+        redis.call('HSET', key, 'tokens', tostring(tokens[i] - 1), 'ts', tostring(now))
+        redis.call('EXPIRE', key, math.ceil(tonumber(ARGV[i * 2])))
+    end
+    return '0'
+    """
+
+    def __init__(self, name: str, client: Redis | None, limits: dict[str, str]):
+        self.name = name
+        self.client = client
+        self.limits = {scope: parse_limit(limit) for scope, limit in limits.items()}
+        self._acquire = client.register_script(self._acquire_script) if client is not None else None
+
+    async def check(self, **identities: str | None) -> None:
+        """ Снять по токену с корзины каждого ключа (scope=значение), 429 если хотя бы одна пуста """
+        if self._acquire is None:
+            return
+        keys, args = [], []
+        for scope, identity in identities.items():
+            if identity:
+                keys.append(f'rate:{self.name}:{scope}:{identity}')
+                args.extend(self.limits[scope])
+        start = time.perf_counter()
+        try:
+            retry_after = float(await self._acquire(keys=keys, args=args))
+        except RedisError as ex:
+            logger.warning(f'Rate limiter ({self.name}) unavailable: {ex}')
+            rate_limit_requests.labels(self.name, 'error').inc()
+            return
+        finally:
+            rate_limit_duration.labels(self.name).observe(time.perf_counter() - start)
+        if retry_after > 0:
+            rate_limit_requests.labels(self.name, 'rejected').inc()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail='Too many attempts, try again later',
+                headers={'Retry-After': str(math.ceil(retry_after))},
+            )
+        rate_limit_requests.labels(self.name, 'allowed').inc()
+
+
+def client_ip(request: Request) -> str | None:
+    return request.client.host if request.client else None
+
+
+login_limiter = RateLimiter('login', redis_rate_limit_client,
+                            {'user': LOGIN_RATE_LIMIT_USER, 'ip': LOGIN_RATE_LIMIT_IP})
+reset_password_limiter = RateLimiter('reset_password', redis_rate_limit_client,
+                                     {'user': RESET_PASSWORD_RATE_LIMIT_USER, 'ip': RESET_PASSWORD_RATE_LIMIT_IP})
@@ -1,28 +1,68 @@
+import time
+import hashlib
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, bindparam
+from sqlalchemy.engine import Row
+from sqlalchemy.engine.result import result_tuple
 
-from config import JWT_SECRET_KEY, JWT_ALGORITHM
+from config import JWT_SECRET_KEY, JWT_ALGORITHM, USER_CACHE_SIZE, USER_CACHE_TTL, TOKEN_CACHE_SIZE
 from database import get_async_session
+from cache import TTLCache, create_cache
 from auth.models import user as user_model
+from auth.hashing import pwd_context, password_hasher
+from tracing import span
+
+USER_BY_USERNAME = select(user_model).where(user_model.c.username == bindparam('username'))
+
+user_fields = [column.key for column in user_model.columns]
+user_row = result_tuple(user_fields)
+user_cache = create_cache(name='user', maxsize=USER_CACHE_SIZE if USER_CACHE_TTL > 0 else 0, ttl=USER_CACHE_TTL,
+                          dumps=lambda user: dict(user._mapping),
+                          loads=lambda data: user_row([data.get(field) for field in user_fields]))
+
+token_cache = TTLCache(name='token', maxsize=TOKEN_CACHE_SIZE, ttl=0)
+
+
+def decode_token(token: str) -> dict:
+    """ Декодировать JWT, уже проверенные токены берутся из кэша до наступления exp """
+    with span('jwt'):
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        payload = token_cache.get(key)
+        if payload is None:
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+            if payload.get('exp'):
+                token_cache.set(key, payload, ttl=payload['exp'] - time.time())
+        return payload
+
+
+async def get_user_by_username(session: AsyncSession, username: str) -> Row | None:
+    user = await session.execute(USER_BY_USERNAME, {'username': username})
+    return user.fetchone()
+
+
+async def invalidate_user(*usernames: str) -> None:
+    """ Сбросить закэшированные строки пользователей после изменения.
+    Без Redis (REDIS_CACHE_ENABLED=0) сбрасывается только кэш этого воркера, остальные воркеры видят
+    прежнюю строку (удаленного или заблокированного пользователя, старый хэш пароля) до USER_CACHE_TTL секунд """
+    for username in filter(None, usernames):
+        await user_cache.invalidate(username)
 
 
 async def get_current_user(
         token: str = Depends(OAuth2PasswordBearer(tokenUrl='auth/login')),
         session: AsyncSession = Depends(get_async_session)) -> user_model:
     try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        payload = decode_token(token)
         username = payload.get('sub')
         if username is None:
             AuthHelper.raise_auth_exception('Could not validate credentials')
-        query = select(user_model).where(user_model.c.username == username)
-        user = await session.execute(query)
-        user = user.fetchone()
+        with span('user'):
+            user = await user_cache.get_or_load(username, lambda: get_user_by_username(session, username))
         if not user:
             AuthHelper.raise_auth_exception('Could not validate credentials')
         if user.is_active is False:
@@ -34,12 +74,12 @@ async def get_current_user(
 
 
 class AuthHelper:
-    pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+    pwd_context = pwd_context
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl='auth/login')
 
     @staticmethod
-    def hash_password(password: str) -> str:
-        return AuthHelper.pwd_context.hash(password)
+    async def hash_password(password: str) -> str:
+        return await password_hasher.hash(password)
 
     @staticmethod
     def raise_auth_exception(message: str) -> None:
@@ -50,8 +90,12 @@ class AuthHelper:
         )
 
     @staticmethod
-    def verify_password(plain_password: str, hashed_password: str) -> bool:
-        return AuthHelper.pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(plain_password: str, hashed_password: str) -> bool:
+        return await password_hasher.verify(plain_password, hashed_password)
+
+    @staticmethod
+    async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
 
     @staticmethod
     def create_access_token(data: dict, expires_delta: timedelta) -> str:
@@ -0,0 +1,166 @@
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable, Callable, Awaitable
+
+import msgpack
+from loguru import logger
+from prometheus_client import Counter
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from config import REDIS_HOST, REDIS_PORT, REDIS_CACHE_DB, REDIS_CACHE_ENABLED, REDIS_CACHE_TTL
+
+cache_requests = Counter('cache_requests_total', 'Cache lookups', ['cache', 'result'])
+
+redis_cache_client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_CACHE_DB) if REDIS_CACHE_ENABLED else None
+
+
+class TTLCache:
+    """ Ограниченный по размеру LRU кэш со временем жизни записей (в рамках одного процесса) """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self._data.get(key)
+        if item is not None and item[0] > time.monotonic():
+            self._data.move_to_end(key)
+            self.hits += 1
+            cache_requests.labels(self.name, 'hit').inc()
+            return item[1]
+        if item is not None:
+            del self._data[key]
+        self.misses += 1
+        cache_requests.labels(self.name, 'miss').inc()
+        return None
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], scope: str | None = None) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = await loader()
+            if value is not None:
+                self.set(key, value)
+        return value
+
+    async def invalidate(self, key: Hashable) -> None:
+        self.delete(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0}
+
+
+def _pack_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(1, obj.isoformat().encode('utf-8'))
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+def _unpack_ext(code: int, data: bytes) -> Any:
+    if code == 1:
+        return datetime.fromisoformat(data.decode('utf-8'))
+    return msgpack.ExtType(code, data)
+
+
+class RedisCache:
+    """ Второй уровень кэша в Redis, общий для всех воркеров и нод.
+
+    Ключи версионированы: инвалидация записывает новую случайную версию, после чего старые значения
+    становятся недостижимы для всех процессов сразу. Версии не повторяются, поэтому после истечения
+    ключа версии прежние значения не становятся снова видны. Локальный TTLCache хранит (версия, значение),
+    поэтому при совпадении версии значение не передается и не десериализуется повторно.
+    """
+
+    _lookup_script = """
+    local version = redis.call('GET', KEYS[1]) or '0'
+    if version == ARGV[2] then
+        return {version}
+    end
+    return {version, redis.call('GET', ARGV[1] .. version)}
+    """
+
+    def __init__(self, name: str, client: Redis, ttl: int, local: TTLCache,
+                 dumps: Callable[[Any], Any] = lambda value: value, loads: Callable[[Any], Any] = lambda value: value):
+        self.name = name
+        self.client = client
+        self.ttl = ttl
+        self.local = local
+        self.dumps = dumps
+        self.loads = loads
+        self._lookup = client.register_script(self._lookup_script)
+
+    def _version_key(self, scope: str) -> str:
+        return f'{self.name}:{scope}:ver'
+
+    def _data_prefix(self, key: Hashable) -> str:
+        return f'{self.name}:{key}:v'
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], scope: str | None = None) -> Any:
+        scope = str(key) if scope is None else scope
+        cached = self.local.get(key)
+        try:
+            result = await self._lookup(keys=[self._version_key(scope)],
+                                        args=[self._data_prefix(key), cached[0] if cached else ''])
+        except RedisError as ex:
+            logger.warning(f'Redis cache ({self.name}) unavailable: {ex}')
+            return await loader()
+        version = result[0].decode('utf-8')
+        if cached and cached[0] == version:
+            return cached[1]
+        if len(result) > 1 and result[1] is not None:
+            cache_requests.labels(f'{self.name}_redis', 'hit').inc()
+            value = self.loads(msgpack.unpackb(result[1], ext_hook=_unpack_ext))
+        else:
+            cache_requests.labels(f'{self.name}_redis', 'miss').inc()
+            value = await loader()
+            if value is not None:
+                try:
+                    await self.client.set(self._data_prefix(key) + version,
+                                          msgpack.packb(self.dumps(value), default=_pack_default), ex=self.ttl)
+                except RedisError as ex:
+                    logger.warning(f'Redis cache ({self.name}) unavailable: {ex}')
+        if value is not None:
+            self.local.set(key, (version, value))
+        return value
+
+    async def invalidate(self, scope: Hashable) -> None:
+        self.local.delete(scope)
+        version_key = self._version_key(str(scope))
+        try:
+            # не INCR: после истечения ключа счетчик начался бы с нуля и снова выдал бы прежнюю версию.
+            # Ключ живет дольше значений, записанных до инвалидации под версией '0' (нет ключа)
+            await self.client.set(version_key, uuid.uuid4().hex, ex=self.ttl * 2)
+        except RedisError as ex:
+            logger.warning(f'Redis cache ({self.name}) invalidation failed: {ex}')
+
+
+def create_cache(name: str, maxsize: int, ttl: float, redis_ttl: int = REDIS_CACHE_TTL,
+                 dumps: Callable[[Any], Any] = lambda value: value,
+                 loads: Callable[[Any], Any] = lambda value: value) -> TTLCache | RedisCache:
+    """ Локальный кэш, либо двухуровневый с Redis если включен REDIS_CACHE_ENABLED """
+    local = TTLCache(name=name, maxsize=maxsize, ttl=ttl)
+    if redis_cache_client is None:
+        return local
+    return RedisCache(name=name, client=redis_cache_client, ttl=redis_ttl, local=local, dumps=dumps, loads=loads)
@@ -0,0 +1,241 @@
+""" Отправка писем из воркера Celery, способ выбирается EMAIL_BACKEND.
+
+pool - постоянные соединения smtplib: каждый процесс воркера держит до SMTP_POOL_SIZE открытых соединений
+и отправляет письма через них, вместо TCP/SMTP рукопожатия на каждое письмо. Соединение, простоявшее
+дольше SMTP_MAX_IDLE, перед использованием проверяется NOOP (серверы закрывают простаивающие сессии);
+при обрыве во время отправки открывается новое соединение и отправка продолжается с неотправленного письма.
+
+async - aiosmtplib: пачка писем расходится по SMTP_CONCURRENCY одновременным сессиям, временные ошибки
+повторяются с экспоненциальной задержкой.
+
+Письма, которые так и не удалось отправить, сохраняются в списке Redis EMAIL_DEAD_LETTER_KEY.
+"""
+import asyncio
+import json
+import os
+import smtplib
+import time
+from datetime import datetime
+from email.message import EmailMessage
+from queue import LifoQueue, Empty, Full
+
+import aiosmtplib
+from loguru import logger
+from redis import Redis
+from redis.exceptions import RedisError
+
+from config import SMTP_HOST, SMTP_PORT, SMTP_POOL_SIZE, SMTP_MAX_IDLE, SMTP_TIMEOUT, EMAIL_BACKEND, SMTP_CONCURRENCY, \
+    SMTP_RETRIES, SMTP_RETRY_BACKOFF, EMAIL_DEAD_LETTER_KEY, EMAIL_DEAD_LETTER_MAX, REDIS_HOST, REDIS_PORT
+
+redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT)
+
+
+def dead_letter(failed: list[tuple[EmailMessage, str]]) -> None:
+    """ Сохранить неотправленные письма (письмо, ошибка) для разбора и повторной отправки """
+    if not failed:
+        return
+    failed_at = datetime.utcnow().isoformat()
+    entries = [json.dumps({'to': message['To'], 'subject': message['Subject'], 'error': error,
+                           'failed_at': failed_at, 'message': message.as_string()}) for message, error in failed]
+    try:
+        with redis_client.pipeline() as pipe:
+            pipe.rpush(EMAIL_DEAD_LETTER_KEY, *entries).ltrim(EMAIL_DEAD_LETTER_KEY, -EMAIL_DEAD_LETTER_MAX, -1)
+            pipe.execute()
+    except RedisError as ex:
+        logger.error(f'Dead letter queue unavailable, {len(entries)} emails lost: {ex}')
+
+# ошибки, после которых соединение непригодно
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, OSError)
+
+
+class SMTPPool:
+    """ Пул SMTP соединений одного процесса (LIFO: чаще используются самые свежие соединения) """
+
+    def __init__(self, host: str, port: int, size: int, max_idle: float, timeout: float):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.opened = 0
+        self._pid = os.getpid()
+        self._idle: LifoQueue[tuple[smtplib.SMTP, float]] = LifoQueue(maxsize=size)
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        self.opened += 1
+        return server
+
+    @staticmethod
+    def _close(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def _acquire(self) -> smtplib.SMTP:
+        if self._pid != os.getpid():
+            # после fork соединения родителя не используются: сокет общий с другим процессом
+            self._pid, self._idle = os.getpid(), LifoQueue(maxsize=self.size)
+        while True:
+            try:
+                server, released = self._idle.get_nowait()
+            except Empty:
+                return self._connect()
+            if time.monotonic() - released < self.max_idle:
+                return server
+            try:
+                if server.noop()[0] == 250:
+                    return server
+            except CONNECTION_ERRORS:
+                pass
+            server.close()
+
+    def _release(self, server: smtplib.SMTP) -> None:
+        try:
+            self._idle.put_nowait((server, time.monotonic()))
+        except Full:
+            self._close(server)
+
+    def send_messages(self, messages: list[EmailMessage]) -> list[str]:
+        """ Отправить письма через одно соединение, вернуть адреса, отклоненные сервером """
+        failed, server = [], self._acquire()
+        index, reconnected = 0, False
+        try:
+            while index < len(messages):
+                try:
+                    server.send_message(messages[index])
+                except CONNECTION_ERRORS:
+                    # одна повторная попытка на письмо: соединение могло быть закрыто сервером между проверкой и отправкой
+                    server.close()
+                    if reconnected:
+                        raise
+                    logger.warning(f'SMTP connection to {self.host}:{self.port} lost, reconnecting')
+                    server, reconnected = self._connect(), True
+                    continue
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as ex:
+                    # сервер отклонил письмо, но сессия после RSET пригодна для следующих
+                    logger.warning(f'SMTP refused message to {messages[index]["To"]}: {ex}')
+                    failed.append((messages[index], str(ex)))
+                index, reconnected = index + 1, False
+        except BaseException:
+            server.close()
+            raise
+        self._release(server)
+        dead_letter(failed)
+        return [message['To'] for message, _ in failed]
+
+    def close(self) -> None:
+        while True:
+            try:
+                server, _ = self._idle.get_nowait()
+            except Empty:
+                return
+            self._close(server)
+
+
+def _is_permanent(ex: Exception) -> bool:
+    """ 5xx - повтор не поможет, обрывы соединения и 4xx - временные """
+    if isinstance(ex, aiosmtplib.SMTPRecipientsRefused):
+        return all(recipient.code >= 500 for recipient in ex.recipients)
+    return isinstance(ex, aiosmtplib.SMTPResponseException) and ex.code >= 500
+
+
+def _describe(ex: Exception) -> str:
+    if isinstance(ex, aiosmtplib.SMTPRecipientsRefused):
+        return '; '.join(f'{recipient.code} {recipient.message}' for recipient in ex.recipients)
+    if isinstance(ex, aiosmtplib.SMTPResponseException):
+        return f'{ex.code} {ex.message}'
+    return str(ex) or type(ex).__name__
+
+
+class AsyncSMTPSender:
+    """ До concurrency SMTP сессий aiosmtplib одновременно, у каждой своя очередь писем из общей пачки.
+
+    Event loop свой на процесс воркера и живет между задачами, поэтому открытые сессии переиспользуются.
+    """
+
+    def __init__(self, host: str, port: int, concurrency: int, retries: int, backoff: float, timeout: float):
+        self.host = host
+        self.port = port
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.opened = 0
+        self._pid = os.getpid()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._idle: list[aiosmtplib.SMTP] = []
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        if self._loop is None or self._pid != os.getpid():
+            self._pid, self._loop, self._idle = os.getpid(), asyncio.new_event_loop(), []
+        return self._loop
+
+    def send_messages(self, messages: list[EmailMessage]) -> list[str]:
+        """ Отправить письма, вернуть адреса, которые не удалось отправить за все попытки """
+        failed = self.loop.run_until_complete(self._send_all(messages))
+        dead_letter(failed)
+        return [message['To'] for message, _ in failed]
+
+    async def _send_all(self, messages: list[EmailMessage]) -> list[tuple[EmailMessage, str]]:
+        pending, failed = iter(messages), []
+
+        async def session() -> None:
+            client = self._idle.pop() if self._idle else None
+            try:
+                for message in pending:
+                    client, error = await self._send(client, message)
+                    if error is not None:
+                        logger.warning(f'Email to {message["To"]} failed: {error}')
+                        failed.append((message, error))
+            finally:
+                if client is not None:
+                    self._idle.append(client)
+
+        await asyncio.gather(*(session() for _ in range(min(self.concurrency, len(messages)))))
+        return failed
+
+    async def _send(self, client: aiosmtplib.SMTP | None,
+                    message: EmailMessage) -> tuple[aiosmtplib.SMTP | None, str | None]:
+        for attempt in range(self.retries + 1):
+            try:
+                if client is None or not client.is_connected:
+                    client = aiosmtplib.SMTP(hostname=self.host, port=self.port, timeout=self.timeout,
+                                             start_tls=False)
+                    await client.connect()
+                    self.opened += 1
+                await client.send_message(message)
+                return client, None
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as ex:
+                # после ошибки состояние сессии неизвестно, следующая попытка - через новое соединение
+                client = await self._discard(client)
+                if _is_permanent(ex) or attempt == self.retries:
+                    return client, _describe(ex)
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    @staticmethod
+    async def _discard(client: aiosmtplib.SMTP | None) -> None:
+        if client is not None and client.is_connected:
+            try:
+                await client.quit()
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+                client.close()
+        return None
+
+    def close(self) -> None:
+        if self._loop is None or self._pid != os.getpid():
+            return
+        for client in self._idle:
+            self._loop.run_until_complete(self._discard(client))
+        self._idle = []
+        self._loop.close()
+        self._loop = None
+
+
+def create_sender() -> SMTPPool | AsyncSMTPSender:
+    if EMAIL_BACKEND == 'async':
+        return AsyncSMTPSender(host=SMTP_HOST, port=SMTP_PORT, concurrency=SMTP_CONCURRENCY, retries=SMTP_RETRIES,
+                               backoff=SMTP_RETRY_BACKOFF, timeout=SMTP_TIMEOUT)
+    return SMTPPool(host=SMTP_HOST, port=SMTP_PORT, size=SMTP_POOL_SIZE, max_idle=SMTP_MAX_IDLE, timeout=SMTP_TIMEOUT)
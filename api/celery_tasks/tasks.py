@@ -1,17 +1,32 @@
-import smtplib
+import asyncio
+import functools
+import os
 from email.message import EmailMessage
-from config import SMTP_HOST, SMTP_PORT, REDIS_PORT, REDIS_HOST, subjects
+from config import REDIS_PORT, REDIS_HOST, subjects
 from celery import Celery
+from celery.exceptions import Ignore
+from celery.signals import worker_process_shutdown
 from loguru import logger
 
+from celery_tasks.mail import create_sender
+from crypt_password.rotation import rotate_keys
+from crypt_password.vault import import_file
+
 celery = Celery('celery_tasks',
                 broker=f'redis://{REDIS_HOST}:{REDIS_PORT}',
                 backend=f'redis://{REDIS_HOST}:{REDIS_PORT}')
 
+email_sender = create_sender()
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'template_email')
+
 
+@functools.lru_cache(maxsize=None)
 def get_content_html(type_email: str) -> str or None:
+    """ Шаблон читается с диска один раз на процесс воркера """
     try:
-        with open(f'template_email/{type_email}.html', 'r') as file:
+        with open(os.path.join(TEMPLATE_DIR, f'{type_email}.html'), 'r') as file:
             content_html = file.read()
             return content_html
     except FileNotFoundError:
@@ -36,5 +51,47 @@ def get_email_template(email_address: str, username: str, type_email: str, token
 @celery.task
 def send_email(email: str, username: str, type_token: str, token: str) -> None:
     email_data = get_email_template(email_address=email, username=username, type_email=type_token, token=token)
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.send_message(email_data)
+    if email_data is not None:
+        email_sender.send_messages([email_data])
+
+
+@celery.task
+def send_email_batch(messages: list[dict]) -> list[str]:
+    """ Пачка писем (аргументы send_email), возвращает адреса с ошибкой отправки (см. EMAIL_BACKEND) """
+    emails = [get_email_template(email_address=message['email'], username=message['username'],
+                                 type_email=message['type_token'], token=message['token']) for message in messages]
+    return email_sender.send_messages([email for email in emails if email is not None])
+
+
+@worker_process_shutdown.connect
+def _close_smtp_connections(**kwargs) -> None:
+    email_sender.close()
+
+
+@celery.task(bind=True)
+def import_vault_file(self, user_id: int, group_id: int, path: str, file_format: str) -> dict:
+    """ Фоновый импорт хранилища, прогресс доступен через состояние задачи (PROGRESS) """
+    def progress(result) -> None:
+        self.update_state(state='PROGRESS', meta={'user_id': user_id, **result.dict()})
+
+    try:
+        result = asyncio.run(import_file(user_id=user_id, group_id=group_id, path=path, file_format=file_format,
+                                         on_progress=progress))
+    except Exception as ex:
+        logger.exception(f'Import vault failed for UserId ({user_id}) and GroupId ({group_id})')
+        self.update_state(state='ERROR', meta={'user_id': user_id, 'error': str(ex)})
+        raise Ignore()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return {'user_id': user_id, **result.dict()}
+
+
+@celery.task(bind=True)
+def rotate_encryption_keys(self, retire: bool = False, rewrap: bool = True) -> dict:
+    """ Ротация ключей шифрования, прогресс и скорость (строк/сек) доступны через состояние задачи (PROGRESS) """
+    def progress(result) -> None:
+        self.update_state(state='PROGRESS', meta=result.dict())
+        logger.info(f'Key rotation progress: {result.dict()}')
+
+    return asyncio.run(rotate_keys(retire=retire, rewrap=rewrap, on_progress=progress)).dict()
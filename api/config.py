@@ -23,26 +23,98 @@ SECRET_AUTH = os.environ.get("SECRET_AUTH")
 LIVE_POOL_DB_CONNECTIONS = int(os.environ.get("LIVE_POOL_DB_CONNECTIONS"))
 COUNT_MAX_CONNECTIONS_DB = int(os.environ.get("COUNT_MAX_CONNECTIONS_DB"))
 COUNT_OVERFLOW_POOL = int(os.environ.get("COUNT_OVERFLOW_POOL"))
+# открыть COUNT_MAX_CONNECTIONS_DB соединений при старте воркера, а не на первых запросах (health.py)
+DB_POOL_WARM_UP: bool = os.environ.get('DB_POOL_WARM_UP', '1') == '1'
+HEALTH_CHECK_TIMEOUT: float = float(os.environ.get('HEALTH_CHECK_TIMEOUT', '2'))  # секунд на проверку Postgres/Redis
+# prepared statements asyncpg на соединение (LRU по тексту SQL), 0 - готовить оператор заново на каждый запрос
+DB_STATEMENT_CACHE_SIZE: int = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', '100'))
+# соединения через PgBouncer в режиме transaction: без кэша prepared statements и с уникальными именами
+DB_PGBOUNCER: bool = os.environ.get('DB_PGBOUNCER', '0') == '1'
+# реплики для read-only ендпоинтов, "host[:port]" через запятую (пользователь, пароль, база - как у primary)
+DB_REPLICA_HOSTS: list[str] = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DB_REPLICA_CHECK_INTERVAL: float = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', '5'))  # секунд между проверками
+DB_REPLICA_MAX_LAG: float = float(os.environ.get('DB_REPLICA_MAX_LAG', '5'))  # секунд отставания, дальше - без реплики
+# секунд после изменений пользователя, в течение которых его чтения идут на primary; не меньше MAX_LAG + CHECK_INTERVAL
+READ_YOUR_WRITES_WINDOW: float = float(os.environ.get('READ_YOUR_WRITES_WINDOW', '10'))
 
 JWT_SECRET_KEY: str = os.environ.get('JWT_SECRET_KEY')
 JWT_ALGORITHM: str = os.environ.get('JWT_ALGORITHM')
 JWT_EXPIRE_MINUTES: int = int(os.environ.get('JWT_EXPIRE_MINUTES'))
 JWT_EXPIRE_MINUTES_RESET_PASSWORD: int = int(os.environ.get('JWT_EXPIRE_MINUTES_RESET_PASSWORD'))
 
+HASH_EXECUTOR: str = os.environ.get('HASH_EXECUTOR', 'thread')  # thread | process
+HASH_WORKERS: int = int(os.environ.get('HASH_WORKERS', '2'))
+HASH_MAX_PENDING: int = int(os.environ.get('HASH_MAX_PENDING', '32'))
+# первая схема - для новых хэшей, хэши остальных схем или с другой стоимостью заменяются при входе.
+# Подобрать стоимость под железо: python benchmarks/calibrate_hash.py --target-ms 250
+PASSWORD_SCHEMES: list[str] = [scheme.strip() for scheme in os.environ.get('PASSWORD_SCHEMES', 'bcrypt').split(',')
+                               if scheme.strip()]  # bcrypt | argon2
+BCRYPT_ROUNDS: int = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+ARGON2_TIME_COST: int = int(os.environ.get('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST: int = int(os.environ.get('ARGON2_MEMORY_COST', '65536'))  # KiB
+ARGON2_PARALLELISM: int = int(os.environ.get('ARGON2_PARALLELISM', '1'))
+
+USER_CACHE_SIZE: int = int(os.environ.get('USER_CACHE_SIZE', '1024'))
+# seconds, 0 - disable. Без REDIS_CACHE_ENABLED кэш у каждого воркера свой: удаленный, заблокированный пользователь
+# или старый хэш пароля в других воркерах видны до USER_CACHE_TTL, поэтому срок - несколько секунд
+USER_CACHE_TTL: float = float(os.environ.get('USER_CACHE_TTL', '5'))
+TOKEN_CACHE_SIZE: int = int(os.environ.get('TOKEN_CACHE_SIZE', '4096'))  # 0 - disable
+
 SMTP_HOST: str = os.environ.get('SMTP_HOST')
 SMTP_PORT: int = int(os.environ.get('SMTP_PORT'))
 SMTP_USER = os.environ.get("SMTP_USER")
 SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD")
+SMTP_POOL_SIZE: int = int(os.environ.get('SMTP_POOL_SIZE', '2'))  # постоянных соединений на процесс воркера Celery
+SMTP_MAX_IDLE: float = float(os.environ.get('SMTP_MAX_IDLE', '30'))  # секунд простоя, после которых соединение проверяется NOOP
+SMTP_TIMEOUT: float = float(os.environ.get('SMTP_TIMEOUT', '10'))
+EMAIL_BACKEND: str = os.environ.get('EMAIL_BACKEND', 'pool')  # pool (smtplib) | async (aiosmtplib)
+SMTP_CONCURRENCY: int = int(os.environ.get('SMTP_CONCURRENCY', '10'))  # одновременных сессий async на процесс
+SMTP_RETRIES: int = int(os.environ.get('SMTP_RETRIES', '3'))
+SMTP_RETRY_BACKOFF: float = float(os.environ.get('SMTP_RETRY_BACKOFF', '0.5'))  # секунд, удваивается на попытку
+EMAIL_DEAD_LETTER_KEY: str = os.environ.get('EMAIL_DEAD_LETTER_KEY', 'email:dead_letter')  # список Redis
+EMAIL_DEAD_LETTER_MAX: int = int(os.environ.get('EMAIL_DEAD_LETTER_MAX', '10000'))
 
 REDIS_HOST: str = os.environ.get('REDIS_HOST')
 REDIS_PORT: int = int(os.environ.get('REDIS_PORT'))
 REDIS_DB: str = os.environ.get('REDIS_DB')
+REDIS_CACHE_ENABLED: bool = os.environ.get('REDIS_CACHE_ENABLED', '0') == '1'
+REDIS_CACHE_DB: int = int(os.environ.get('REDIS_CACHE_DB', '1'))
+REDIS_CACHE_TTL: int = int(os.environ.get('REDIS_CACHE_TTL', '300'))
+# ограничение частоты входа и сброса пароля (token bucket в Redis): "<запросов>/<секунд>" на ключ
+RATE_LIMIT_ENABLED: bool = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_DB: int = int(os.environ.get('RATE_LIMIT_DB', '2'))
+LOGIN_RATE_LIMIT_USER: str = os.environ.get('LOGIN_RATE_LIMIT_USER', '10/60')
+LOGIN_RATE_LIMIT_IP: str = os.environ.get('LOGIN_RATE_LIMIT_IP', '100/60')
+RESET_PASSWORD_RATE_LIMIT_USER: str = os.environ.get('RESET_PASSWORD_RATE_LIMIT_USER', '3/900')
+RESET_PASSWORD_RATE_LIMIT_IP: str = os.environ.get('RESET_PASSWORD_RATE_LIMIT_IP', '20/900')
+
+BULK_MAX_ITEMS: int = int(os.environ.get('BULK_MAX_ITEMS', '10000'))
+CRYPTO_EXECUTOR: str = os.environ.get('CRYPTO_EXECUTOR', 'thread')  # inline | thread | process
+CRYPTO_WORKERS: int = int(os.environ.get('CRYPTO_WORKERS', '4'))
+CRYPTO_PARALLEL_THRESHOLD: int = int(os.environ.get('CRYPTO_PARALLEL_THRESHOLD', '64'))  # меньше - в event loop
+VAULT_IMPORT_DIR: str = os.environ.get('VAULT_IMPORT_DIR', '/tmp/vault_imports')  # общий каталог API и Celery
+# секунд, после которых файл фонового импорта считается брошенным и удаляется при следующей загрузке
+VAULT_IMPORT_MAX_AGE: float = float(os.environ.get('VAULT_IMPORT_MAX_AGE', '86400'))
+# файлы больше импортируются в Celery и без background=true: разбор и валидация блокируют event loop
+VAULT_INLINE_MAX_BYTES: int = int(os.environ.get('VAULT_INLINE_MAX_BYTES', str(1 << 20)))
 
 ENCRYPTION_KEY: bytes = os.environ.get('ENCRYPTION_KEY').encode('utf-8')
+# мастер-ключи для ключей данных пользователей, через запятую: первый шифрует, остальные только расшифровывают
+MASTER_KEYS: list[bytes] = [key.strip().encode('utf-8')
+                            for key in os.environ.get('MASTER_KEYS', ENCRYPTION_KEY.decode('utf-8')).split(',')
+                            if key.strip()]
+DATA_KEY_CACHE_SIZE: int = int(os.environ.get('DATA_KEY_CACHE_SIZE', '1024'))
+DATA_KEY_CACHE_TTL: int = int(os.environ.get('DATA_KEY_CACHE_TTL', '300'))
+KEY_ROTATION_BATCH_SIZE: int = int(os.environ.get('KEY_ROTATION_BATCH_SIZE', '500'))
+KEY_ROTATION_PAUSE: float = float(os.environ.get('KEY_ROTATION_PAUSE', '0.1'))  # секунд между пачками
 
 subjects = {'reset_password': 'Сброс пароля PasswordManager для пользователя {} сервиса ManagePassword'}
 alphabet_password = string.ascii_letters + string.digits + string.punctuation
 
+TRACING_ENABLED: bool = os.environ.get('TRACING_ENABLED', '0') == '1'  # Server-Timing и тайминги этапов в логе
+# каталог метрик prometheus_client для нескольких воркеров gunicorn, должен быть задан до запуска процесса
+PROMETHEUS_MULTIPROC_DIR: str | None = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
 LOG_LEVEL = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO"))
 JSON_LOGS = True if os.environ.get("JSON_LOGS", "0") == "1" else False
 WORKERS = int(os.environ.get("GUNICORN_WORKERS", "5"))
@@ -0,0 +1,86 @@
+import asyncio
+import math
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from cryptography.fernet import Fernet
+from prometheus_client import Histogram, Counter
+
+from config import CRYPTO_EXECUTOR, CRYPTO_WORKERS, CRYPTO_PARALLEL_THRESHOLD
+from crypt_password.utils import encrypt_password, decrypt_password
+from tracing import span
+
+crypto_duration = Histogram('crypto_seconds', 'Time spent encrypting or decrypting stored passwords',
+                            ['operation'])
+crypto_operations = Counter('crypto_operations_total', 'Stored passwords encrypted or decrypted', ['operation'])
+
+
+def _encrypt_chunk(items: list[tuple[str, Fernet]]) -> list[str]:
+    return [encrypt_password(original_password=password, cipher=cipher) for password, cipher in items]
+
+
+def _decrypt_chunk(items: list[tuple[str, Fernet]]) -> list[str]:
+    return [decrypt_password(encrypted_password=password, cipher=cipher) for password, cipher in items]
+
+
+class CryptoService:
+    """ Шифрование паролей (Fernet) вне event loop.
+
+    Пачки от parallel_threshold элементов делятся на части по числу воркеров пула
+    (AES/HMAC в cryptography отпускают GIL), меньшие выполняются сразу: передача одной операции
+    в пул дороже самой операции. executor_type='inline' - всегда в event loop.
+    """
+
+    def __init__(self, workers: int, parallel_threshold: int, executor_type: str = 'thread'):
+        self.workers = workers
+        self.parallel_threshold = parallel_threshold
+        self.executor_type = executor_type
+        self._executor: Executor | None = None
+
+    @property
+    def executor(self) -> Executor:
+        # пул создается лениво, уже внутри воркера gunicorn (после fork)
+        if self._executor is None:
+            if self.executor_type == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='crypto')
+        return self._executor
+
+    async def encrypt(self, password: str, cipher: Fernet) -> str:
+        return (await self.encrypt_many([(password, cipher)]))[0]
+
+    async def decrypt(self, encrypted_password: str, cipher: Fernet) -> str:
+        return (await self.decrypt_many([(encrypted_password, cipher)]))[0]
+
+    async def encrypt_many(self, items: list[tuple[str, Fernet]]) -> list[str]:
+        """ (пароль, ключ) -> шифротексты в том же порядке """
+        return await self._run('encrypt', _encrypt_chunk, items)
+
+    async def decrypt_many(self, items: list[tuple[str, Fernet]]) -> list[str]:
+        """ (шифротекст, ключ) -> пароли в том же порядке """
+        return await self._run('decrypt', _decrypt_chunk, items)
+
+    async def _run(self, operation: str, func, items: list) -> list[str]:
+        start = time.perf_counter()
+        crypto_operations.labels(operation).inc(len(items))
+        try:
+            with span(operation):
+                if self.executor_type == 'inline' or len(items) < max(self.parallel_threshold, 1):
+                    return func(items)
+                loop = asyncio.get_running_loop()
+                size = math.ceil(len(items) / self.workers)
+                chunks = await asyncio.gather(*(loop.run_in_executor(self.executor, func, items[offset:offset + size])
+                                                for offset in range(0, len(items), size)))
+                return [result for chunk in chunks for result in chunk]
+        finally:
+            crypto_duration.labels(operation).observe(time.perf_counter() - start)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+crypto_service = CryptoService(workers=CRYPTO_WORKERS, parallel_threshold=CRYPTO_PARALLEL_THRESHOLD,
+                               executor_type=CRYPTO_EXECUTOR)
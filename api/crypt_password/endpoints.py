@@ -1,22 +1,54 @@
-from typing import List, Optional, Annotated
+import os
+from typing import List, Optional, Annotated, Type
+from uuid import uuid4
 
-from fastapi import APIRouter, Depends, status, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Body, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, conlist, conint
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import insert, update, select, delete, and_
+from sqlalchemy import insert, delete, and_, Select
 from sqlalchemy.exc import IntegrityError
 
-from crypt_password.models import group_password_table, password_table
+from crypt_password.models import group_password_table
 from auth.models import user as user_model
 from database import get_async_session
+from replicas import get_read_session
+from config import BULK_MAX_ITEMS, VAULT_IMPORT_DIR, VAULT_IMPORT_MAX_AGE, VAULT_INLINE_MAX_BYTES
 from auth.utils import get_current_user
-from crypt_password.utils import generate_password, check_auth_data_by_user, check_group_by_user, decrypt_password
+from crypt_password.utils import generate_password, invalidate_ownership, check_group_by_user
+from crypt_password.queries import create_auth_data_by_user, update_group_by_user, update_auth_data_by_user, \
+    delete_auth_data_by_user, get_hashed_password_by_user, search_auth_data_query, get_group_ids_by_user, \
+    create_auth_data_many, update_auth_data_many_by_user, delete_auth_data_many_by_user, get_hashed_passwords_by_user, \
+    page_params, ALL_GROUPS, AUTH_DATA_GROUPS, AUTH_DATA_BY_GROUP
 from crypt_password.schemas import NewGroup, UpdateGroup, AuthDataGroup, NewAuthData, UpdateAuthData, DecryptAuthData,\
-    SearchData, SearchedAuthData, AllGroups, AuthDataByGroup
+    DecryptMany, SearchData, SearchedAuthData, AllGroups, AuthDataByGroup, Pagination, BulkItemResult, ImportResult, \
+    ImportTask
+from crypt_password.crypto import crypto_service
+from crypt_password.keys import encrypt_rows, get_cipher, key_retired, reencrypt_if_retired
+from crypt_password.vault import VaultFormat, read_records, import_records, export_rows, spool_file, sweep_spool
+from celery_tasks.tasks import import_vault_file
 
 router = APIRouter()
 
 
+def get_pagination(after_id: Optional[int] = Query(default=None, gt=0),
+                   limit: Optional[int] = Query(default=None, gt=0, le=1000),
+                   stream: bool = False) -> Pagination:
+    """ Параметры keyset пагинации списков, stream=true - ответ построчно в NDJSON """
+    return Pagination(after_id=after_id, limit=limit, stream=stream)
+
+
+def stream_rows(session: AsyncSession, query: Select, schema: Type[BaseModel], params: dict | None = None) \
+        -> StreamingResponse:
+    """ Отдать строки по мере чтения из серверного курсора, не собирая весь результат в памяти """
+    async def rows():
+        result = await session.stream(query, params)
+        async for row in result:
+            yield schema(**row._mapping).json() + '\n'
+    return StreamingResponse(rows(), media_type='application/x-ndjson')
+
+
 @router.post('/create_group')
 async def create_group(group: NewGroup,
                        session: AsyncSession = Depends(get_async_session),
@@ -45,18 +77,16 @@ async def update_group(data_group: UpdateGroup,
                        session: AsyncSession = Depends(get_async_session),
                        current_user: user_model = Depends(get_current_user)) -> JSONResponse:
     """ Обновить данные группы """
-    if not await check_group_by_user(session=session, user_id=current_user.id, group_id=data_group.id):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'No found group by User ({current_user.username})',
-        )
     data_group = data_group.dict()
+    group_id = data_group.pop('id')
     try:
-        stmt = update(group_password_table)\
-            .where(group_password_table.c.id == data_group.get('id')).values(**data_group)
-        await session.execute(stmt)
+        if not await update_group_by_user(session=session, user_id=current_user.id, group_id=group_id,
+                                          values=data_group):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No found group by User ({current_user.username})',
+            )
         await session.commit()
-        data_group.pop('id')
         message, status_code, error = f"Successfully update group ({data_group}) " \
                                       f"for User {current_user.username}", status.HTTP_200_OK, None
     except IntegrityError as ex:
@@ -77,6 +107,7 @@ async def delete_group(group_id: Annotated[int, Query(gt=0)],
                                                    group_password_table.c.user_id == current_user.id))
     await session.execute(stmt)
     await session.commit()
+    await invalidate_ownership(current_user.id)
     return JSONResponse(
         content={'message': 'Group successfully delete'},
         status_code=status.HTTP_200_OK,
@@ -84,28 +115,26 @@ async def delete_group(group_id: Annotated[int, Query(gt=0)],
 
 
 @router.get('/get_all_my_groups', response_model=List[Optional[AllGroups]])
-async def get_all_groups_user(session: AsyncSession = Depends(get_async_session),
+async def get_all_groups_user(pagination: Pagination = Depends(get_pagination),
+                              session: AsyncSession = Depends(get_read_session),
                               current_user: user_model = Depends(get_current_user)) -> List[Optional[AllGroups]]:
     """ Получить все группы пользователя """
-    query = select(group_password_table.c.id, group_password_table.c.name, group_password_table.c.description)\
-        .where(group_password_table.c.user_id == current_user.id)
-    all_groups = await session.execute(query)
+    params = {'user_id': current_user.id, **page_params(pagination.after_id, pagination.limit)}
+    if pagination.stream:
+        return stream_rows(session, ALL_GROUPS, AllGroups, params)
+    all_groups = await session.execute(ALL_GROUPS, params)
     return [AllGroups(**group._mapping) for group in all_groups.all()]
 
 
 @router.get('/get_data_groups', response_model=List[Optional[AuthDataGroup]])
-async def get_auth_data_by_group(session: AsyncSession = Depends(get_async_session),
+async def get_auth_data_by_group(pagination: Pagination = Depends(get_pagination),
+                                 session: AsyncSession = Depends(get_read_session),
                                  current_user: user_model = Depends(get_current_user)) -> List[Optional[AuthDataGroup]]:
     """ Получить все записи из учетных данных по группам """
-    query = select(group_password_table.c.id.label('group_id'),
-                   group_password_table.c.name.label('group_name'),
-                   group_password_table.c.description.label('group_description'),
-                   password_table.c.id.label('auth_data_id'),
-                   password_table.c.service_name,
-                   password_table.c.login)\
-        .join(password_table, password_table.c.group_id == group_password_table.c.id)\
-        .where(group_password_table.c.user_id == current_user.id)
-    auth_data_groups = await session.execute(query)
+    params = {'user_id': current_user.id, **page_params(pagination.after_id, pagination.limit)}
+    if pagination.stream:
+        return stream_rows(session, AUTH_DATA_GROUPS, AuthDataGroup, params)
+    auth_data_groups = await session.execute(AUTH_DATA_GROUPS, params)
     return [AuthDataGroup(**auth_data._mapping) for auth_data in auth_data_groups.all()]
 
 
@@ -113,16 +142,23 @@ async def get_auth_data_by_group(session: AsyncSession = Depends(get_async_sessi
 async def create_auth_data(auth_data: NewAuthData,
                            session: AsyncSession = Depends(get_async_session),
                            current_user: user_model = Depends(get_current_user)) -> JSONResponse:
-    """ Добавить новый пароль в базу привязанный к группе """
-    if not await check_group_by_user(session=session, user_id=current_user.id, group_id=auth_data.group_id):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'No found group by User ({current_user.username}) AND GroupId ({auth_data.group_id})',
-        )
-    auth_data = auth_data.dict()
+    """ Добавить новый пароль в базу привязанный к группе.
+    Один запрос к БД при активном ключе пользователя в кэше, иначе еще SELECT ключа (и INSERT при первом
+    шифровании); запись, отклоненная из-за выведенного ключа, - еще проверка ключа и повтор """
+    row = auth_data.dict()
+    auth_data, = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row)])
     try:
-        stmt = insert(password_table).values(**auth_data)
-        await session.execute(stmt)
+        auth_data_id = await create_auth_data_by_user(session=session, user_id=current_user.id, auth_data=auth_data)
+        if auth_data_id is None and await key_retired(session=session, user_id=current_user.id,
+                                                      key_id=auth_data.get('key_id')):
+            auth_data, = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row)])
+            auth_data_id = await create_auth_data_by_user(session=session, user_id=current_user.id,
+                                                          auth_data=auth_data)
+        if auth_data_id is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No found group by User ({current_user.username}) AND GroupId ({auth_data.get("group_id")})',
+            )
         await session.commit()
         message, status_code, error = f"Successfully created auth_data ({auth_data.get('service_name')} " \
                                       f"and {auth_data.get('login')} ) " \
@@ -131,6 +167,8 @@ async def create_auth_data(auth_data: NewAuthData,
         message, status_code, error = f"Auth Data by ServiceName -> {auth_data.get('service_name')} " \
                                       f"and Login -> {auth_data.get('login')} for User {current_user.username} " \
                                       f"already exists.", status.HTTP_409_CONFLICT, ex
+    except HTTPException:
+        raise
     except Exception as ex:
         message, status_code, error = "", status.HTTP_409_CONFLICT, ex
     return JSONResponse(
@@ -143,24 +181,35 @@ async def create_auth_data(auth_data: NewAuthData,
 async def update_auth_data(update_data: UpdateAuthData,
                            session: AsyncSession = Depends(get_async_session),
                            current_user: user_model = Depends(get_current_user)) -> JSONResponse:
-    """ Обновить авторизационные данные """
-    if not await check_auth_data_by_user(session=session, user_id=current_user.id, auth_data_id=update_data.id):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f'No found auth by User ({current_user.username}) and AuthDataId ({update_data.id})',
-        )
-    update_data = update_data.dict()
+    """ Обновить авторизационные данные.
+    Запросов к БД - как в create_auth_data, без нового пароля - всегда один """
+    row = update_data.dict()
+    auth_data_id = row.pop('id')
+    update_data, = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row)])
     try:
-        stmt = update(password_table).where(password_table.c.id == update_data.get('id')).values(**update_data)
-        await session.execute(stmt)
+        updated = await update_auth_data_by_user(session=session, user_id=current_user.id,
+                                                 auth_data_id=auth_data_id, values=update_data)
+        if not updated and await key_retired(session=session, user_id=current_user.id,
+                                             key_id=update_data.get('key_id')):
+            update_data, = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row)])
+            updated = await update_auth_data_by_user(session=session, user_id=current_user.id,
+                                                     auth_data_id=auth_data_id, values=update_data)
+        if not updated:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f'No found auth by User ({current_user.username}) and AuthDataId ({auth_data_id})',
+            )
         await session.commit()
-        update_data.pop('id')
-        message, status_code, error = f"Successfully update auth_data ({update_data}) " \
+        # только поля пользователя: шифротекст и key_id не уходят ни в ответ, ни в логи
+        changes = {field: row[field] for field in ('service_name', 'login') if row.get(field) is not None}
+        message, status_code, error = f"Successfully update auth_data ({changes}) " \
                                       f"for User {current_user.username}", status.HTTP_200_OK, None
     except IntegrityError as ex:
         message, status_code, error = f"AuthData by ServiceName -> {update_data.get('service_name')} " \
                                       f"or Login {update_data.get('login')} for User {current_user.username} " \
                                       f"already exists. Change parameters", status.HTTP_409_CONFLICT, ex
+    except HTTPException:
+        raise
     except Exception as ex:
         message, status_code, error = "", status.HTTP_409_CONFLICT, ex
     return JSONResponse(
@@ -174,30 +223,130 @@ async def delete_auth_data(auth_data_id: Annotated[int, Query(gt=0)],
                            session: AsyncSession = Depends(get_async_session),
                            current_user: user_model = Depends(get_current_user)) -> JSONResponse:
     """ Удалить авторизационные данные """
-    if not await check_auth_data_by_user(session=session, user_id=current_user.id, auth_data_id=auth_data_id):
+    if not await delete_auth_data_by_user(session=session, user_id=current_user.id, auth_data_id=auth_data_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'No found auth_data by User ({current_user.username}) and AuthDataId ({auth_data_id})',
         )
-    stmt = delete(password_table).where(password_table.c.id == auth_data_id)
-    await session.execute(stmt)
     await session.commit()
+    await invalidate_ownership(current_user.id)
     return JSONResponse(
         content={'message': 'AuthData successfully delete'},
         status_code=status.HTTP_200_OK,
     )
 
 
+@router.post('/create_auth_data_bulk', response_model=List[BulkItemResult])
+async def create_auth_data_bulk(auth_data: conlist(NewAuthData, min_items=1, max_items=BULK_MAX_ITEMS),
+                                session: AsyncSession = Depends(get_async_session),
+                                current_user: user_model = Depends(get_current_user)) -> List[BulkItemResult]:
+    """ Добавить пачку паролей одной транзакцией """
+    rows = [item.dict() for item in auth_data]
+    group_ids = await get_group_ids_by_user(session=session, user_id=current_user.id,
+                                            group_ids={row['group_id'] for row in rows})
+    owned_rows = [row for row in rows if row['group_id'] in group_ids]
+    encrypted = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row) for row in owned_rows])
+    created = await create_auth_data_many(session=session, user_id=current_user.id, rows=encrypted)
+    if len(created) < len(encrypted):
+        encrypted = await reencrypt_if_retired(session=session, user_id=current_user.id, rows=owned_rows,
+                                               encrypted=encrypted)
+        if encrypted is not None:
+            created.update(await create_auth_data_many(session=session, user_id=current_user.id, rows=encrypted))
+    await session.commit()
+    results = []
+    for index, row in enumerate(rows):
+        if row['group_id'] not in group_ids:
+            results.append(BulkItemResult(index=index, status='not_found'))
+            continue
+        # pop: повтор той же записи внутри запроса считается конфликтом
+        auth_data_id = created.pop((row['service_name'], row['login'], row['group_id']), None)
+        results.append(BulkItemResult(index=index, auth_data_id=auth_data_id,
+                                      status='created' if auth_data_id else 'conflict'))
+    return results
+
+
+@router.put('/update_auth_data_bulk', response_model=List[BulkItemResult])
+async def update_auth_data_bulk(update_data: conlist(UpdateAuthData, min_items=1, max_items=BULK_MAX_ITEMS),
+                                session: AsyncSession = Depends(get_async_session),
+                                current_user: user_model = Depends(get_current_user)) -> List[BulkItemResult]:
+    """ Обновить пачку авторизационных данных одной транзакцией """
+    rows = [item.dict() for item in update_data]
+    unique_rows = {}
+    for row in rows:
+        unique_rows.setdefault(row['id'], row)
+    unique_rows = list(unique_rows.values())
+    encrypted = await encrypt_rows(session=session, user_id=current_user.id, rows=[dict(row) for row in unique_rows])
+    conflicts = set()
+    try:
+        async with session.begin_nested():
+            updated = await update_auth_data_many_by_user(session=session, user_id=current_user.id, rows=encrypted)
+            if len(updated) < len(encrypted):
+                retry = await reencrypt_if_retired(session=session, user_id=current_user.id, rows=unique_rows,
+                                                   encrypted=encrypted)
+                if retry is not None:
+                    encrypted = retry
+                    updated |= await update_auth_data_many_by_user(session=session, user_id=current_user.id,
+                                                                   rows=encrypted)
+    except IntegrityError:
+        # нарушение уникальности где-то в пачке - повторяем построчно, чтобы найти конфликтующие записи
+        retry = await reencrypt_if_retired(session=session, user_id=current_user.id, rows=unique_rows,
+                                           encrypted=encrypted)
+        encrypted = retry if retry is not None else encrypted
+        updated = set()
+        for row in encrypted:
+            values = {key: value for key, value in row.items() if key != 'id'}
+            try:
+                async with session.begin_nested():
+                    if await update_auth_data_by_user(session=session, user_id=current_user.id,
+                                                      auth_data_id=row['id'], values=values):
+                        updated.add(row['id'])
+            except IntegrityError:
+                conflicts.add(row['id'])
+    await session.commit()
+    results, seen = [], set()
+    for index, row in enumerate(rows):
+        if row['id'] in conflicts or row['id'] in seen:
+            item_status = 'conflict'
+        else:
+            item_status = 'updated' if row['id'] in updated else 'not_found'
+        seen.add(row['id'])
+        results.append(BulkItemResult(index=index, auth_data_id=row['id'], status=item_status))
+    return results
+
+
+@router.delete('/delete_auth_data_bulk', response_model=List[BulkItemResult])
+async def delete_auth_data_bulk(auth_data_ids: conlist(conint(gt=0), min_items=1, max_items=BULK_MAX_ITEMS) = Body(),
+                                session: AsyncSession = Depends(get_async_session),
+                                current_user: user_model = Depends(get_current_user)) -> List[BulkItemResult]:
+    """ Удалить пачку авторизационных данных """
+    deleted = await delete_auth_data_many_by_user(session=session, user_id=current_user.id,
+                                                  auth_data_ids=sorted(set(auth_data_ids)))
+    await session.commit()
+    await invalidate_ownership(current_user.id)
+    results, seen = [], set()
+    for index, auth_data_id in enumerate(auth_data_ids):
+        # удаляется одна запись, повтор того же id в запросе - конфликт, как в update_auth_data_bulk
+        if auth_data_id in seen:
+            item_status = 'conflict'
+        else:
+            item_status = 'deleted' if auth_data_id in deleted else 'not_found'
+        seen.add(auth_data_id)
+        results.append(BulkItemResult(index=index, auth_data_id=auth_data_id, status=item_status))
+    return results
+
+
 @router.get('/get_all_auth_data_by_group', response_model=List[Optional[AuthDataByGroup]])
 async def get_all_auth_data_by_group(group_id: Annotated[int, Query(gt=0)],
-                                     session: AsyncSession = Depends(get_async_session),
+                                     pagination: Pagination = Depends(get_pagination),
+                                     session: AsyncSession = Depends(get_read_session),
                                      current_user: user_model = Depends(get_current_user)) \
         -> List[Optional[AuthDataByGroup]]:
     """ Получить все авторизационные данные по id group """
-    query = select(password_table.c.id, password_table.c.service_name, password_table.c.login) \
-        .join(group_password_table, group_password_table.c.id == password_table.c.group_id) \
-        .where(and_(group_password_table.c.user_id == current_user.id, group_password_table.c.id == group_id))
-    auth_data_by_group = await session.execute(query)
+    params = {'user_id': current_user.id, 'group_id': group_id,
+              **page_params(pagination.after_id, pagination.limit)}
+    if pagination.stream:
+        return stream_rows(session, AUTH_DATA_BY_GROUP, AuthDataByGroup, params)
+    auth_data_by_group = await session.execute(AUTH_DATA_BY_GROUP, params)
     return [AuthDataByGroup(**auth_data._mapping) for auth_data in auth_data_by_group.all()]
 
 
@@ -206,39 +355,108 @@ async def get_decrypt_password(auth_data_id: Annotated[int, Query(gt=0)],
                                session: AsyncSession = Depends(get_async_session),
                                current_user: user_model = Depends(get_current_user)) -> DecryptAuthData:
     """ Показать расшифрованный пароль по auth_data_id """
-    if not await check_auth_data_by_user(session=session, user_id=current_user.id, auth_data_id=auth_data_id):
+    auth_data = await get_hashed_password_by_user(session=session, user_id=current_user.id, auth_data_id=auth_data_id)
+    if auth_data is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f'No found auth by User ({current_user.username}) and AuthDataId ({auth_data_id})',
         )
-    query = select(password_table.c.hashed_password) \
-        .join(group_password_table, group_password_table.c.id == password_table.c.group_id) \
-        .where(and_(group_password_table.c.user_id == current_user.id, password_table.c.id == auth_data_id))
-    auth_data = await session.execute(query)
-    auth_data = auth_data.fetchone()
     return DecryptAuthData(auth_data_id=auth_data_id,
-                           decrypt_password=decrypt_password(encrypted_password=auth_data.hashed_password))
+                           decrypt_password=await crypto_service.decrypt(
+                               auth_data.hashed_password, get_cipher(auth_data.key_id, auth_data.wrapped_key)))
+
+
+@router.post('/decrypt_many', response_model=List[DecryptAuthData])
+async def get_decrypt_many(decrypt_data: DecryptMany,
+                           session: AsyncSession = Depends(get_async_session),
+                           current_user: user_model = Depends(get_current_user)) -> List[DecryptAuthData]:
+    """ Расшифрованные пароли по списку auth_data_id либо всей группы (group_id).
+    Чужие и несуществующие id в ответ не попадают """
+    rows = await get_hashed_passwords_by_user(session=session, user_id=current_user.id,
+                                              auth_data_ids=decrypt_data.auth_data_ids,
+                                              group_id=decrypt_data.group_id)
+    passwords = await crypto_service.decrypt_many([(row.hashed_password, get_cipher(row.key_id, row.wrapped_key))
+                                                   for row in rows])
+    return [DecryptAuthData(auth_data_id=row.id, decrypt_password=password) for row, password in zip(rows, passwords)]
 
 
 @router.post('/search_auth_data', response_model=List[Optional[SearchedAuthData]])
 async def search_auth_data(search_data: SearchData,
-                           session: AsyncSession = Depends(get_async_session),
+                           stream: bool = False,
+                           session: AsyncSession = Depends(get_read_session),
                            current_user: user_model = Depends(get_current_user)) -> List[Optional[SearchedAuthData]]:
     """ Поиск пароля по имени сервиса логину """
-    query = select(group_password_table.c.name.label('group_name'),
-                   password_table.c.id.label('auth_data_id'),
-                   password_table.c.service_name,
-                   password_table.c.login) \
-        .join(password_table, password_table.c.group_id == group_password_table.c.id) \
-        .filter(group_password_table.c.user_id == current_user.id)
-    if search_data.login:
-        query = query.filter(password_table.c.login.like(f'%{search_data.login}%'))
-    if search_data.service_name:
-        query = query.filter(password_table.c.service_name.like(f'%{search_data.service_name}%'))
+    query = search_auth_data_query(user_id=current_user.id, login=search_data.login,
+                                   service_name=search_data.service_name, mode=search_data.mode,
+                                   limit=search_data.limit, after_id=search_data.after_id)
+    if stream:
+        return stream_rows(session, query, SearchedAuthData)
     searched_auth_data = await session.execute(query)
     return [SearchedAuthData(**auth_data._mapping) for auth_data in searched_auth_data.all()]
 
 
+@router.post('/import_vault', response_model=ImportResult)
+async def import_vault(group_id: Annotated[int, Query(gt=0)],
+                       file: UploadFile,
+                       file_format: VaultFormat = Query(default='csv', alias='format'),
+                       background: bool = False,
+                       session: AsyncSession = Depends(get_async_session),
+                       current_user: user_model = Depends(get_current_user)) -> ImportResult | JSONResponse:
+    """ Импорт паролей в группу из CSV/NDJSON экспорта браузера или другого менеджера паролей.
+    background=true - импорт выполняет Celery, прогресс в /import_vault/{task_id}.
+    Файлы больше VAULT_INLINE_MAX_BYTES всегда импортируются в фоне (ответ 202) """
+    if not await check_group_by_user(session=session, user_id=current_user.id, group_id=group_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'No found group by User ({current_user.username})',
+        )
+    if not background and file.size is not None and file.size <= VAULT_INLINE_MAX_BYTES:
+        return await import_records(session=session, user_id=current_user.id, group_id=group_id,
+                                    records=read_records(file.file, file_format))
+
+    os.makedirs(VAULT_IMPORT_DIR, exist_ok=True)
+    await run_in_threadpool(sweep_spool, VAULT_IMPORT_DIR, VAULT_IMPORT_MAX_AGE)
+    task_id = uuid4().hex
+    path = os.path.join(VAULT_IMPORT_DIR, f'{task_id}.{file_format}')
+    await run_in_threadpool(spool_file, file.file, path)
+    # владелец записывается до постановки задачи, чтобы статус был доступен сразу
+    import_vault_file.backend.store_result(task_id, {'user_id': current_user.id, **ImportResult().dict()}, 'QUEUED')
+    import_vault_file.apply_async(kwargs={'user_id': current_user.id, 'group_id': group_id, 'path': path,
+                                          'file_format': file_format}, task_id=task_id)
+    return JSONResponse(
+        content=ImportTask(task_id=task_id, state='QUEUED').dict(),
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+@router.get('/import_vault/{task_id}', response_model=ImportTask)
+async def import_vault_status(task_id: str,
+                              current_user: user_model = Depends(get_current_user)) -> ImportTask:
+    """ Состояние фонового импорта """
+    task = import_vault_file.AsyncResult(task_id)
+    info = task.info if isinstance(task.info, dict) else {}
+    if info.get('user_id') != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'No found import task by User ({current_user.username})',
+        )
+    return ImportTask(**info, task_id=task_id, state=task.state)
+
+
+@router.get('/export_vault')
+async def export_vault(file_format: VaultFormat = Query(default='csv', alias='format'),
+                       group_id: Optional[int] = Query(default=None, gt=0),
+                       session: AsyncSession = Depends(get_async_session),
+                       current_user: user_model = Depends(get_current_user)) -> StreamingResponse:
+    """ Выгрузить пароли пользователя (всех групп или одной) потоком в CSV/NDJSON """
+    media_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(
+        export_rows(session=session, user_id=current_user.id, file_format=file_format, group_id=group_id),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="vault.{file_format}"'},
+    )
+
+
 @router.get('/generate_password')
 async def generate_password_endpoint(length_password: int = Query(gt=6, le=30, default=12)) -> JSONResponse:
     """ Сгенерировать пароль """
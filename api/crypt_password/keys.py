@@ -0,0 +1,94 @@
+""" Envelope шифрование: у каждого пользователя свой ключ данных (Fernet), который хранится в БД
+зашифрованным мастер-ключом (MultiFernet). У каждой записи auth_data есть key_id ключа, которым она зашифрована """
+from cryptography.fernet import Fernet, MultiFernet
+from sqlalchemy import select, and_, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import TTLCache
+from config import MASTER_KEYS, DATA_KEY_CACHE_SIZE, DATA_KEY_CACHE_TTL
+from crypt_password.models import data_key_table
+from crypt_password.crypto import crypto_service
+from crypt_password.utils import cipher_suite
+from tracing import traced
+
+master_cipher = MultiFernet([Fernet(key) for key in MASTER_KEYS])
+
+# расшифрованные ключи живут только в памяти процесса, в Redis не попадают
+data_keys = TTLCache(name='data_key', maxsize=DATA_KEY_CACHE_SIZE, ttl=DATA_KEY_CACHE_TTL)  # key_id -> Fernet
+active_keys = TTLCache(name='active_data_key', maxsize=DATA_KEY_CACHE_SIZE, ttl=DATA_KEY_CACHE_TTL)  # user_id
+
+
+KEY_IS_ACTIVE = select(data_key_table.c.is_active).where(data_key_table.c.id == bindparam('key_id'))
+
+
+def wrap_key(key: bytes) -> str:
+    return master_cipher.encrypt(key).decode('utf-8')
+
+
+def get_cipher(key_id: int | None, wrapped_key: str | None) -> Fernet:
+    """ Ключ записи по key_id, wrapped_key приходит из того же запроса что и шифротекст (LEFT JOIN data_key) """
+    if key_id is None:
+        return cipher_suite
+    cipher = data_keys.get(key_id)
+    if cipher is None:
+        cipher = Fernet(master_cipher.decrypt(wrapped_key.encode('utf-8')))
+        data_keys.set(key_id, cipher)
+    return cipher
+
+
+@traced('data_key')
+async def get_active_key(session: AsyncSession, user_id: int) -> tuple[int, Fernet]:
+    """ Активный ключ пользователя, создается при первом шифровании """
+    cached = active_keys.get(user_id)
+    if cached is not None:
+        return cached
+    query = select(data_key_table.c.id, data_key_table.c.wrapped_key) \
+        .where(and_(data_key_table.c.user_id == user_id, data_key_table.c.is_active))
+    row = (await session.execute(query)).first()
+    if row is None:
+        # отдельная транзакция: ключ не должен пропасть при откате запроса, который его создал
+        async with AsyncSession(session.bind) as key_session:
+            stmt = pg_insert(data_key_table) \
+                .values(user_id=user_id, wrapped_key=wrap_key(Fernet.generate_key())) \
+                .on_conflict_do_nothing(index_elements=['user_id'], index_where=data_key_table.c.is_active) \
+                .returning(data_key_table.c.id, data_key_table.c.wrapped_key)
+            row = (await key_session.execute(stmt)).first() or (await key_session.execute(query)).first()
+            await key_session.commit()
+    key = (row.id, get_cipher(row.id, row.wrapped_key))
+    active_keys.set(user_id, key)
+    return key
+
+
+async def key_retired(session: AsyncSession, user_id: int, key_id: int | None) -> bool:
+    """ Запись отклонена, потому что ключ из кэша уже выведен из оборота (ротация в другом процессе)?
+    Тогда ключ забывается, и запрос можно один раз повторить с активным ключом из БД """
+    if key_id is None or (await session.execute(KEY_IS_ACTIVE, {'key_id': key_id})).scalar():
+        return False
+    active_keys.delete(user_id)
+    return True
+
+
+async def reencrypt_if_retired(session: AsyncSession, user_id: int, rows: list[dict],
+                               encrypted: list[dict]) -> list[dict] | None:
+    """ Пачка encrypt_rows(rows) записана не полностью, потому что ключ из кэша уже выведен из оборота?
+    Тогда rows шифруются заново активным ключом для одного повтора, иначе None """
+    key_id = next((row['key_id'] for row in encrypted if row.get('key_id') is not None), None)
+    if not await key_retired(session=session, user_id=user_id, key_id=key_id):
+        return None
+    return await encrypt_rows(session=session, user_id=user_id, rows=[dict(row) for row in rows])
+
+
+async def encrypt_rows(session: AsyncSession, user_id: int, rows: list[dict]) -> list[dict]:
+    """ password -> hashed_password + key_id активным ключом пользователя, строки без пароля не меняются.
+    Вызывается после проверки доступа, чтобы не шифровать данные отклоненных запросов """
+    passwords = [(row, row.pop('password', None)) for row in rows]
+    passwords = [(row, password) for row, password in passwords if password]
+    if not passwords:
+        return rows
+    key_id, cipher = await get_active_key(session=session, user_id=user_id)
+    encrypted = await crypto_service.encrypt_many([(password, cipher) for _, password in passwords])
+    for (row, _), hashed_password in zip(passwords, encrypted):
+        row['hashed_password'] = hashed_password
+        row['key_id'] = key_id
+    return rows
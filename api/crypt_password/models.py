@@ -1,4 +1,7 @@
-from sqlalchemy import Column, Integer, String, Table, Identity, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Table, Identity, ForeignKey, Index, DDL, event, Boolean, TIMESTAMP, \
+    text, UniqueConstraint, ForeignKeyConstraint, PrimaryKeyConstraint
 
 from database import metadata
 
@@ -6,19 +9,65 @@ from database import metadata
 group_password_table = Table(
     "group",
     metadata,
-    Column("id", Integer, Identity(), nullable=False, unique=True),
-    Column("name", String(length=512), nullable=False, primary_key=True),
+    Column("id", Integer, Identity(), primary_key=True),
+    Column("name", String(length=512), nullable=False),
     Column("description", String(length=2048)),
-    Column("user_id", Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False, primary_key=True),
+    Column("user_id", Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+    UniqueConstraint("user_id", "name", name="uq_group_user_name"),
+    # проверки владения (user_id, id) читают только индекс, он же - цель составного внешнего ключа auth_data
+    UniqueConstraint("user_id", "id", name="uq_group_user_id"),
 )
 
 
+# ключи данных пользователей (envelope шифрование), хранятся зашифрованными мастер-ключом
+data_key_table = Table(
+    "data_key",
+    metadata,
+    Column("id", Integer, Identity(), primary_key=True),
+    Column("user_id", Integer, ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+    Column("wrapped_key", String(length=512), nullable=False),
+    Column("is_active", Boolean, server_default='true', nullable=False),
+    Column("created_at", TIMESTAMP, default=datetime.utcnow),
+    # после вывода из оборота процессы еще до DATA_KEY_CACHE_TTL шифруют им из кэша, удаление - не раньше
+    Column("retired_at", TIMESTAMP),
+    # у пользователя ровно один активный ключ, выведенные из оборота ждут перешифрования записей
+    Index("ix_data_key_user_active", "user_id", unique=True, postgresql_where=text("is_active")),
+)
+
+
+# auth_data секционирована хэшем владельца: запросы с user_id читают одну секцию, ее индексы и vacuum
+# не зависят от числа пользователей. Изменение числа секций - только новой миграцией с копированием данных
+AUTH_DATA_PARTITIONS = 16
+
 password_table = Table(
     "auth_data",
     metadata,
-    Column("id", Integer, Identity(), nullable=False, unique=True),
-    Column("service_name", String(length=512), nullable=False, primary_key=True),
-    Column("login", String(length=128), nullable=False, primary_key=True),
+    Column("id", Integer, Identity(), nullable=False),
+    # владелец группы и ключ секционирования: запросы фильтруются по нему без соединения с group
+    Column("user_id", Integer, nullable=False),
+    Column("service_name", String(length=512), nullable=False),
+    Column("login", String(length=128), nullable=False),
     Column("hashed_password", String(length=2048), nullable=False),
-    Column("group_id", Integer, ForeignKey('group.id', ondelete='CASCADE'), nullable=False, primary_key=True)
+    Column("group_id", Integer, nullable=False),
+    # NULL - зашифровано общим ENCRYPTION_KEY
+    Column("key_id", Integer, ForeignKey('data_key.id'), index=True),
+    # первичный ключ и уникальность секционированной таблицы обязаны включать ключ секционирования
+    PrimaryKeyConstraint("user_id", "id", name="auth_data_pkey"),
+    # user_id записи всегда совпадает с владельцем ее группы
+    ForeignKeyConstraint(["user_id", "group_id"], ["group.user_id", "group.id"], ondelete='CASCADE',
+                         name="auth_data_group_fkey"),
+    UniqueConstraint("user_id", "group_id", "service_name", "login", name="uq_auth_data_group_service_login"),
+    # списки и проверки владения по пользователю - index-only scan, без чтения строк с шифротекстом
+    Index("ix_auth_data_user_id", "user_id", "id", postgresql_include=["group_id", "service_name", "login"]),
+    # триграммные индексы для поиска по подстроке/похожести (search_auth_data)
+    Index("ix_auth_data_service_name_trgm", "service_name",
+          postgresql_using="gin", postgresql_ops={"service_name": "gin_trgm_ops"}),
+    Index("ix_auth_data_login_trgm", "login", postgresql_using="gin", postgresql_ops={"login": "gin_trgm_ops"}),
+    postgresql_partition_by="HASH (user_id)",
 )
+
+event.listen(password_table, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+for remainder in range(AUTH_DATA_PARTITIONS):
+    event.listen(password_table, "after_create",
+                 DDL(f"CREATE TABLE auth_data_p{remainder} PARTITION OF auth_data "
+                     f"FOR VALUES WITH (MODULUS {AUTH_DATA_PARTITIONS}, REMAINDER {remainder})"))
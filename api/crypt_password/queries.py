@@ -0,0 +1,259 @@
+""" Запросы к группам и паролям, в которых проверка владельца входит в сам оператор (один запрос к БД) """
+from sqlalchemy import select, insert, update, delete, and_, or_, func, values, column, bindparam, literal, exists, \
+    Select, ColumnElement
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from crypt_password.models import group_password_table, password_table, data_key_table
+from tracing import traced
+
+BATCH_SIZE = 1000  # строк в одном операторе, asyncpg ограничивает число параметров 32767
+
+
+def paginated(query: Select, column) -> Select:
+    """ Keyset пагинация с параметрами after_id и limit (page_params): строки строго после after_id
+    в порядке возрастания column """
+    return query.where(column > bindparam('after_id')).order_by(column).limit(bindparam('limit'))
+
+
+def page_params(after_id: int | None, limit: int | None) -> dict:
+    # id начинаются с 1, LIMIT NULL в Postgres - без ограничения
+    return {'after_id': after_id or 0, 'limit': limit}
+
+
+# Частые запросы собираются один раз, значения передаются параметрами при выполнении: на запрос не строятся
+# выражения Core и не считается ключ кэша компиляции (он запоминается в операторе), SQL берется из кэша engine.
+# benchmarks/bench_primitives.py сравнивает с построением на каждый запрос
+ALL_GROUPS = paginated(
+    select(group_password_table.c.id, group_password_table.c.name, group_password_table.c.description)
+    .where(group_password_table.c.user_id == bindparam('user_id')),
+    group_password_table.c.id)
+
+AUTH_DATA_GROUPS = paginated(
+    select(group_password_table.c.id.label('group_id'),
+           group_password_table.c.name.label('group_name'),
+           group_password_table.c.description.label('group_description'),
+           password_table.c.id.label('auth_data_id'),
+           password_table.c.service_name,
+           password_table.c.login)
+    .join(password_table, password_table.c.group_id == group_password_table.c.id)
+    .where(password_table.c.user_id == bindparam('user_id')),
+    password_table.c.id)
+
+AUTH_DATA_BY_GROUP = paginated(
+    select(password_table.c.id, password_table.c.service_name, password_table.c.login)
+    .where(and_(password_table.c.user_id == bindparam('user_id'), password_table.c.group_id == bindparam('group_id'))),
+    password_table.c.id)
+
+# имена параметров не совпадают с колонками auth_data, иначе INSERT принял бы их за VALUES.
+# Ключ должен быть еще активным: процесс мог взять из кэша ключ, который ротация уже вывела из оборота
+CREATE_AUTH_DATA = insert(password_table) \
+    .from_select(['service_name', 'login', 'hashed_password', 'key_id', 'group_id', 'user_id'],
+                 select(bindparam('new_service_name', type_=password_table.c.service_name.type),
+                        bindparam('new_login', type_=password_table.c.login.type),
+                        bindparam('new_hashed_password', type_=password_table.c.hashed_password.type),
+                        data_key_table.c.id, group_password_table.c.id, group_password_table.c.user_id)
+                 .where(and_(group_password_table.c.id == bindparam('owner_group_id'),
+                             group_password_table.c.user_id == bindparam('owner_id'),
+                             data_key_table.c.id == bindparam('new_key_id'),
+                             data_key_table.c.user_id == group_password_table.c.user_id,
+                             data_key_table.c.is_active))) \
+    .returning(password_table.c.id)
+
+DELETE_AUTH_DATA = delete(password_table) \
+    .where(and_(password_table.c.id == bindparam('auth_data_id'), password_table.c.user_id == bindparam('user_id'))) \
+    .returning(password_table.c.id)
+
+HASHED_PASSWORD = select(password_table.c.hashed_password, password_table.c.key_id, data_key_table.c.wrapped_key) \
+    .outerjoin(data_key_table, data_key_table.c.id == password_table.c.key_id) \
+    .where(and_(password_table.c.user_id == bindparam('user_id'), password_table.c.id == bindparam('auth_data_id')))
+
+
+def _hashed_passwords_query(by_ids: bool, by_group: bool) -> Select:
+    query = select(password_table.c.id, password_table.c.hashed_password, password_table.c.key_id,
+                   data_key_table.c.wrapped_key) \
+        .outerjoin(data_key_table, data_key_table.c.id == password_table.c.key_id) \
+        .where(password_table.c.user_id == bindparam('user_id')) \
+        .order_by(password_table.c.id)
+    if by_ids:
+        query = query.where(password_table.c.id.in_(bindparam('auth_data_ids', expanding=True)))
+    if by_group:
+        query = query.where(password_table.c.group_id == bindparam('group_id'))
+    return query
+
+
+HASHED_PASSWORDS = {(by_ids, by_group): _hashed_passwords_query(by_ids, by_group)
+                    for by_ids in (False, True) for by_group in (False, True)}
+
+
+@traced('db')
+async def create_auth_data_by_user(session: AsyncSession, user_id: int, auth_data: dict) -> int | None:
+    """ INSERT ... SELECT из группы пользователя, None если группа не принадлежит пользователю
+    или ключ key_id уже выведен из оборота """
+    result = await session.execute(CREATE_AUTH_DATA, {
+        'new_service_name': auth_data['service_name'], 'new_login': auth_data['login'],
+        'new_hashed_password': auth_data['hashed_password'], 'new_key_id': auth_data.get('key_id'),
+        'owner_group_id': auth_data['group_id'], 'owner_id': user_id})
+    return result.scalar()
+
+
+@traced('db')
+async def update_group_by_user(session: AsyncSession, user_id: int, group_id: int, values: dict) -> bool:
+    stmt = update(group_password_table) \
+        .where(and_(group_password_table.c.id == group_id, group_password_table.c.user_id == user_id)) \
+        .values(**values) \
+        .returning(group_password_table.c.id)
+    result = await session.execute(stmt)
+    return result.scalar() is not None
+
+
+@traced('db')
+async def update_auth_data_by_user(session: AsyncSession, user_id: int, auth_data_id: int, values: dict) -> bool:
+    """ UPDATE записи пользователя, False если записи нет или новый key_id уже выведен из оборота """
+    stmt = update(password_table) \
+        .where(and_(password_table.c.id == auth_data_id, password_table.c.user_id == user_id)) \
+        .values(**values) \
+        .returning(password_table.c.id)
+    if values.get('key_id') is not None:
+        stmt = stmt.where(and_(data_key_table.c.id == values['key_id'], data_key_table.c.user_id == user_id,
+                               data_key_table.c.is_active))
+    result = await session.execute(stmt)
+    return result.scalar() is not None
+
+
+@traced('db')
+async def delete_auth_data_by_user(session: AsyncSession, user_id: int, auth_data_id: int) -> bool:
+    result = await session.execute(DELETE_AUTH_DATA, {'user_id': user_id, 'auth_data_id': auth_data_id})
+    return result.scalar() is not None
+
+
+@traced('db')
+async def get_hashed_password_by_user(session: AsyncSession, user_id: int, auth_data_id: int):
+    """ (hashed_password, key_id, wrapped_key) записи пользователя, ключ данных в том же запросе """
+    result = await session.execute(HASHED_PASSWORD, {'user_id': user_id, 'auth_data_id': auth_data_id})
+    return result.first()
+
+
+@traced('db')
+async def get_hashed_passwords_by_user(session: AsyncSession, user_id: int, auth_data_ids: list[int] | None = None,
+                                       group_id: int | None = None) -> list:
+    """ (id, hashed_password, key_id, wrapped_key) записей пользователя по списку id либо всей группы,
+    одним запросом """
+    query = HASHED_PASSWORDS[auth_data_ids is not None, group_id is not None]
+    result = await session.execute(query, {'user_id': user_id, 'auth_data_ids': auth_data_ids, 'group_id': group_id})
+    return result.all()
+
+
+def _search_condition(column, value: str, mode: str) -> ColumnElement:
+    if mode == 'fuzzy':
+        return column.op('%')(value)
+    pattern = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    pattern = f'{pattern}%' if mode == 'prefix' else f'%{pattern}%'
+    return column.ilike(pattern, escape='\\')
+
+
+@traced('db')
+async def get_group_ids_by_user(session: AsyncSession, user_id: int, group_ids: set[int]) -> set[int]:
+    """ Какие из group_ids принадлежат пользователю (одним запросом на все группы) """
+    query = select(group_password_table.c.id) \
+        .where(and_(group_password_table.c.user_id == user_id, group_password_table.c.id.in_(sorted(group_ids))))
+    result = await session.execute(query)
+    return set(result.scalars().all())
+
+
+@traced('db')
+async def create_auth_data_many(session: AsyncSession, user_id: int, rows: list[dict]) -> dict[tuple, int]:
+    """ INSERT ... SELECT FROM (VALUES ...) ON CONFLICT DO NOTHING пачками по BATCH_SIZE, группы должны
+    принадлежать user_id. Строки с ключом key_id, уже выведенным из оборота, не вставляются, как и в CREATE_AUTH_DATA.
+    Возвращает id созданных записей по ключу (service_name, login, group_id), пропущенные - конфликты """
+    created = {}
+    for start in range(0, len(rows), BATCH_SIZE):
+        data = values(column('service_name', password_table.c.service_name.type),
+                      column('login', password_table.c.login.type),
+                      column('hashed_password', password_table.c.hashed_password.type),
+                      column('key_id', password_table.c.key_id.type),
+                      column('group_id', password_table.c.group_id.type),
+                      name='data') \
+            .data([(row['service_name'], row['login'], row['hashed_password'], row['key_id'], row['group_id'])
+                   for row in rows[start:start + BATCH_SIZE]])
+        stmt = pg_insert(password_table) \
+            .from_select(['service_name', 'login', 'hashed_password', 'key_id', 'group_id', 'user_id'],
+                         select(data.c.service_name, data.c.login, data.c.hashed_password, data.c.key_id,
+                                data.c.group_id, literal(user_id, password_table.c.user_id.type))
+                         .join(data_key_table, and_(data_key_table.c.id == data.c.key_id,
+                                                    data_key_table.c.user_id == user_id,
+                                                    data_key_table.c.is_active))) \
+            .on_conflict_do_nothing(index_elements=['user_id', 'group_id', 'service_name', 'login']) \
+            .returning(password_table.c.id, password_table.c.service_name, password_table.c.login,
+                       password_table.c.group_id)
+        result = await session.execute(stmt)
+        created.update({(row.service_name, row.login, row.group_id): row.id for row in result})
+    return created
+
+
+@traced('db')
+async def update_auth_data_many_by_user(session: AsyncSession, user_id: int, rows: list[dict]) -> set[int]:
+    """ UPDATE auth_data ... FROM (VALUES ...) ... RETURNING пачками по BATCH_SIZE,
+    незаданные поля остаются прежними. Строки с новым key_id, уже выведенным из оборота, не обновляются """
+    updated = set()
+    for start in range(0, len(rows), BATCH_SIZE):
+        data = values(column('id', password_table.c.id.type),
+                      column('service_name', password_table.c.service_name.type),
+                      column('login', password_table.c.login.type),
+                      column('hashed_password', password_table.c.hashed_password.type),
+                      column('key_id', password_table.c.key_id.type),
+                      name='data') \
+            .data([(row['id'], row.get('service_name'), row.get('login'), row.get('hashed_password'),
+                    row.get('key_id')) for row in rows[start:start + BATCH_SIZE]])
+        stmt = update(password_table) \
+            .where(and_(password_table.c.id == data.c.id, password_table.c.user_id == user_id,
+                        or_(data.c.key_id.is_(None),
+                            exists().where(and_(data_key_table.c.id == data.c.key_id,
+                                                data_key_table.c.user_id == user_id,
+                                                data_key_table.c.is_active))))) \
+            .values(service_name=func.coalesce(data.c.service_name, password_table.c.service_name),
+                    login=func.coalesce(data.c.login, password_table.c.login),
+                    hashed_password=func.coalesce(data.c.hashed_password, password_table.c.hashed_password),
+                    key_id=func.coalesce(data.c.key_id, password_table.c.key_id)) \
+            .returning(password_table.c.id)
+        result = await session.execute(stmt)
+        updated.update(result.scalars().all())
+    return updated
+
+
+@traced('db')
+async def delete_auth_data_many_by_user(session: AsyncSession, user_id: int, auth_data_ids: list[int]) -> set[int]:
+    stmt = delete(password_table) \
+        .where(and_(password_table.c.id.in_(auth_data_ids), password_table.c.user_id == user_id)) \
+        .returning(password_table.c.id)
+    result = await session.execute(stmt)
+    return set(result.scalars().all())
+
+
+def _search_rank(table, login: str | None, service_name: str | None) -> ColumnElement:
+    return sum(func.similarity(table.c[name], value.lower())
+               for name, value in (('login', login), ('service_name', service_name)) if value)
+
+
+def search_auth_data_query(user_id: int, login: str | None, service_name: str | None,
+                           mode: str = 'contains', limit: int = 50, after_id: int | None = None) -> Select:
+    """ Поиск по триграммным индексам (pg_trgm), результаты упорядочены по похожести.
+    after_id - последняя полученная запись, следующая страница продолжается после ее (rank, id) """
+    query = select(group_password_table.c.name.label('group_name'),
+                   password_table.c.id.label('auth_data_id'),
+                   password_table.c.service_name,
+                   password_table.c.login) \
+        .join(password_table, password_table.c.group_id == group_password_table.c.id) \
+        .where(password_table.c.user_id == user_id)
+    for column, value in ((password_table.c.login, login), (password_table.c.service_name, service_name)):
+        if value:
+            query = query.where(_search_condition(column, value.lower(), mode))
+    rank = _search_rank(password_table, login, service_name)
+    if after_id:
+        # курсор только из записей владельца: иначе по странице можно узнать ранг чужой записи
+        cursor = password_table.alias('cursor')
+        cursor_rank = select(_search_rank(cursor, login, service_name)) \
+            .where(and_(cursor.c.user_id == user_id, cursor.c.id == after_id)) \
+            .scalar_subquery()
+        query = query.where(or_(rank < cursor_rank, and_(rank == cursor_rank, password_table.c.id > after_id)))
+    return query.order_by(rank.desc(), password_table.c.id).limit(limit)
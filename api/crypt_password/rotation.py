@@ -0,0 +1,156 @@
+""" Фоновая ротация ключей шифрования без остановки сервиса.
+
+Записи перешифровываются небольшими пачками, каждая в своей транзакции, с паузой между пачками.
+Блокировки не держатся на время расшифровки: UPDATE применяется, только если шифротекст не изменился
+с момента чтения, иначе запись пропускается (ее уже переписал пользователь).
+
+Вывод ключей из оборота сбрасывает кэш только этого процесса, воркеры API шифруют ключом из своего
+кэша еще до DATA_KEY_CACHE_TTL. Поэтому после retire перешифрование ждет grace секунд (по умолчанию
+DATA_KEY_CACHE_TTL) - записи, сделанные за это время старым ключом, попадут в тот же проход, - а ключ
+удаляется не раньше чем через grace после вывода, когда на него уже не сошлется ни один процесс.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Callable
+
+from loguru import logger
+from sqlalchemy import select, update, delete, and_, or_, exists, func, values, column
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from config import KEY_ROTATION_BATCH_SIZE, KEY_ROTATION_PAUSE, DATA_KEY_CACHE_TTL
+from database import DATABASE_URL
+from crypt_password.keys import master_cipher, get_cipher, get_active_key, active_keys
+from crypt_password.models import password_table, data_key_table
+from crypt_password.schemas import RotationProgress
+from crypt_password.crypto import crypto_service
+
+
+def _stale_condition():
+    # старый общий ключ либо выведенный из оборота ключ пользователя
+    return or_(password_table.c.key_id.is_(None), data_key_table.c.is_active.is_(False))
+
+
+async def retire_data_keys(session: AsyncSession) -> None:
+    """ Вывести из оборота активные ключи всех пользователей, новые создаются при следующем шифровании """
+    await session.execute(update(data_key_table).where(data_key_table.c.is_active)
+                          .values(is_active=False, retired_at=datetime.utcnow()))
+    await session.commit()
+    active_keys.clear()
+
+
+async def rewrap_data_keys(session: AsyncSession, progress: RotationProgress, batch_size: int) -> None:
+    """ Перешифровать ключи данных первым мастер-ключом из MASTER_KEYS """
+    last_id = 0
+    while True:
+        query = select(data_key_table.c.id, data_key_table.c.wrapped_key) \
+            .where(data_key_table.c.id > last_id).order_by(data_key_table.c.id).limit(batch_size)
+        rows = (await session.execute(query)).all()
+        if not rows:
+            return
+        data = values(column('id', data_key_table.c.id.type),
+                      column('old_key', data_key_table.c.wrapped_key.type),
+                      column('new_key', data_key_table.c.wrapped_key.type),
+                      name='data') \
+            .data([(row.id, row.wrapped_key, master_cipher.rotate(row.wrapped_key.encode('utf-8')).decode('utf-8'))
+                   for row in rows])
+        stmt = update(data_key_table) \
+            .where(and_(data_key_table.c.id == data.c.id, data_key_table.c.wrapped_key == data.c.old_key)) \
+            .values(wrapped_key=data.c.new_key) \
+            .returning(data_key_table.c.id)
+        progress.rewrapped_keys += len((await session.execute(stmt)).all())
+        await session.commit()
+        last_id = rows[-1].id
+
+
+async def rotate_auth_data(session: AsyncSession, progress: RotationProgress, batch_size: int, pause: float,
+                           on_progress: Callable[[RotationProgress], None] | None = None) -> None:
+    """ Перешифровать записи со старыми ключами активными ключами их владельцев """
+    base = select(password_table.c.id) \
+        .outerjoin(data_key_table, data_key_table.c.id == password_table.c.key_id) \
+        .where(_stale_condition())
+    progress.total = (await session.execute(select(func.count()).select_from(base.subquery()))).scalar()
+    start, last_id = time.perf_counter(), 0
+    while True:
+        query = select(password_table.c.id, password_table.c.hashed_password, password_table.c.key_id,
+                       data_key_table.c.wrapped_key, password_table.c.user_id) \
+            .outerjoin(data_key_table, data_key_table.c.id == password_table.c.key_id) \
+            .where(and_(password_table.c.id > last_id, _stale_condition())) \
+            .order_by(password_table.c.id).limit(batch_size)
+        rows = (await session.execute(query)).all()
+        if not rows:
+            break
+        new_keys = {user_id: await get_active_key(session=session, user_id=user_id)
+                    for user_id in {row.user_id for row in rows}}
+        passwords = await crypto_service.decrypt_many([(row.hashed_password, get_cipher(row.key_id, row.wrapped_key))
+                                                       for row in rows])
+        encrypted = await crypto_service.encrypt_many([(password, new_keys[row.user_id][1])
+                                                       for row, password in zip(rows, passwords)])
+        data = values(column('id', password_table.c.id.type),
+                      column('user_id', password_table.c.user_id.type),
+                      column('old_password', password_table.c.hashed_password.type),
+                      column('new_password', password_table.c.hashed_password.type),
+                      column('key_id', password_table.c.key_id.type),
+                      name='data') \
+            .data([(row.id, row.user_id, row.hashed_password, hashed_password, new_keys[row.user_id][0])
+                   for row, hashed_password in zip(rows, encrypted)])
+        stmt = update(password_table) \
+            .where(and_(password_table.c.user_id == data.c.user_id, password_table.c.id == data.c.id,
+                        password_table.c.hashed_password == data.c.old_password)) \
+            .values(hashed_password=data.c.new_password, key_id=data.c.key_id) \
+            .returning(password_table.c.id)
+        rotated = len((await session.execute(stmt)).all())
+        await session.commit()
+
+        last_id = rows[-1].id
+        progress.rotated += rotated
+        progress.skipped += len(rows) - rotated
+        progress.elapsed = time.perf_counter() - start
+        progress.rows_per_second = (progress.rotated + progress.skipped) / progress.elapsed
+        if on_progress is not None:
+            on_progress(progress)
+        await asyncio.sleep(pause)
+
+
+async def delete_unused_keys(session: AsyncSession, progress: RotationProgress, grace: float) -> None:
+    """ Удалить ключи, выведенные из оборота больше grace секунд назад, которыми не зашифровано ни одной записи """
+    stmt = delete(data_key_table) \
+        .where(and_(data_key_table.c.is_active.is_(False),
+                    data_key_table.c.retired_at <= datetime.utcnow() - timedelta(seconds=grace),
+                    ~exists().where(password_table.c.key_id == data_key_table.c.id)))
+    progress.deleted_keys = (await session.execute(stmt)).rowcount
+    await session.commit()
+
+
+async def rotate_keys(retire: bool = False, rewrap: bool = True, batch_size: int = KEY_ROTATION_BATCH_SIZE,
+                      pause: float = KEY_ROTATION_PAUSE, session: AsyncSession | None = None,
+                      on_progress: Callable[[RotationProgress], None] | None = None,
+                      grace: float = DATA_KEY_CACHE_TTL) -> RotationProgress:
+    """ retire - сменить ключи данных всех пользователей, rewrap - перешифровать ключи данных новым мастер-ключом,
+    grace - сколько процессы могут шифровать выведенным ключом из кэша.
+    Без session (Celery) работает через свое подключение к БД """
+    if session is None:
+        engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+        try:
+            async with sessionmaker(engine, class_=AsyncSession)() as session:
+                return await rotate_keys(retire=retire, rewrap=rewrap, batch_size=batch_size, pause=pause,
+                                         session=session, on_progress=on_progress, grace=grace)
+        finally:
+            await engine.dispose()
+
+    progress = RotationProgress()
+    if retire:
+        await retire_data_keys(session=session)
+        retired = time.monotonic()
+    if rewrap:
+        await rewrap_data_keys(session=session, progress=progress, batch_size=batch_size)
+    if retire and grace > 0:
+        logger.info(f'Data keys retired, waiting {grace}s for cached keys to expire in other processes')
+        await asyncio.sleep(max(0.0, retired + grace - time.monotonic()))
+    await rotate_auth_data(session=session, progress=progress, batch_size=batch_size, pause=pause,
+                           on_progress=on_progress)
+    await delete_unused_keys(session=session, progress=progress, grace=grace)
+    logger.info(f'Key rotation finished: {progress.dict()}')
+    return progress
@@ -1,7 +1,7 @@
-from typing import Optional
+from typing import Optional, Literal
 
-from pydantic import BaseModel, root_validator, Field
-from crypt_password.utils import encrypt_password
+from pydantic import BaseModel, root_validator, Field, conlist, conint
+from config import BULK_MAX_ITEMS
 
 
 class NewGroup(BaseModel):
@@ -32,6 +32,12 @@ class UpdateGroup(BaseModel):
         return values
 
 
+class Pagination(BaseModel):
+    after_id: Optional[int]
+    limit: Optional[int]
+    stream: bool = False
+
+
 class AllGroups(BaseModel):
     id: int
     name: str
@@ -58,7 +64,6 @@ class NewAuthData(BaseModel):
     def validator_fields_create_auth_data(cls, values):
         values['service_name'] = values.get('service_name').lower()
         values['login'] = values.get('login').lower()
-        values['hashed_password'] = encrypt_password(original_password=values.pop('password'))
         return values
 
 
@@ -74,9 +79,10 @@ class UpdateAuthData(BaseModel):
         id_auth_data = values.pop('id')
         if not any(values.values()):
             raise ValueError('At least one parameter must be filled')
-        values['hashed_password'] = encrypt_password(original_password=values.get('password')) \
-            if values.get('password') else None
+        password = values.pop('password', None)
         values = {key: value.lower() for key, value in values.items() if value}
+        if password:
+            values['password'] = password
         values['id'] = id_auth_data
         return values
 
@@ -92,18 +98,62 @@ class DecryptAuthData(BaseModel):
     decrypt_password: str
 
 
+class DecryptMany(BaseModel):
+    auth_data_ids: Optional[conlist(conint(gt=0), min_items=1, max_items=BULK_MAX_ITEMS)]
+    group_id: Optional[int] = Field(gt=0)
+
+    @root_validator
+    @classmethod
+    def validator_fields_decrypt_many(cls, values):
+        if (values.get('auth_data_ids') is None) == (values.get('group_id') is None):
+            raise ValueError('Exactly one of auth_data_ids or group_id must be filled')
+        return values
+
+
 class SearchData(BaseModel):
     service_name: Optional[str] = Field(max_length=512)
     login: Optional[str] = Field(max_length=128)
+    mode: Literal['contains', 'prefix', 'fuzzy'] = 'contains'
+    limit: int = Field(default=50, gt=0, le=500)
+    after_id: Optional[int] = Field(gt=0)
 
     @root_validator
     @classmethod
     def validator_fields_search_auth_data(cls, values):
-        if not any(values.values()):
+        if not (values.get('service_name') or values.get('login')):
             raise ValueError('At least one parameter must be filled')
         return values
 
 
+class BulkItemResult(BaseModel):
+    index: int
+    auth_data_id: Optional[int]
+    status: Literal['created', 'updated', 'deleted', 'conflict', 'not_found']
+
+
+class ImportResult(BaseModel):
+    processed: int = 0
+    created: int = 0
+    conflicts: int = 0
+    invalid: int = 0
+
+
+class ImportTask(ImportResult):
+    task_id: str
+    state: str
+    error: Optional[str]
+
+
+class RotationProgress(BaseModel):
+    total: int = 0
+    rotated: int = 0
+    skipped: int = 0
+    rewrapped_keys: int = 0
+    deleted_keys: int = 0
+    elapsed: float = 0.0
+    rows_per_second: float = 0.0
+
+
 class SearchedAuthData(BaseModel):
     group_name: str
     auth_data_id: int
@@ -1,22 +1,33 @@
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
 import secrets
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, bindparam
 
-from config import ENCRYPTION_KEY, alphabet_password
-from crypt_password.models import password_table, group_password_table
+from cache import TTLCache, RedisCache, redis_cache_client
+from config import ENCRYPTION_KEY, alphabet_password, USER_CACHE_SIZE, REDIS_CACHE_TTL
+from crypt_password.models import group_password_table
+from tracing import traced
 
-cipher_suite = Fernet(ENCRYPTION_KEY)
+OWNED_GROUP = select(group_password_table.c.id) \
+    .where(and_(group_password_table.c.user_id == bindparam('user_id'),
+                group_password_table.c.id == bindparam('group_id')))
 
+cipher_suite = Fernet(ENCRYPTION_KEY)  # записи без key_id, до перехода на ключи пользователей
 
-def encrypt_password(original_password: str) -> str:
+# Кэшируются только положительные проверки владения, версия ключей общая на пользователя
+ownership_cache = RedisCache(name='owner', client=redis_cache_client, ttl=REDIS_CACHE_TTL,
+                             local=TTLCache(name='owner', maxsize=USER_CACHE_SIZE, ttl=REDIS_CACHE_TTL)) \
+    if redis_cache_client is not None else None
+
+
+def encrypt_password(original_password: str, cipher: Fernet | MultiFernet = cipher_suite) -> str:
     password = original_password.encode('utf-8')
-    encrypted_password = cipher_suite.encrypt(password).decode('utf-8')
+    encrypted_password = cipher.encrypt(password).decode('utf-8')
     return encrypted_password
 
 
-def decrypt_password(encrypted_password: str) -> str:
-    decrypted_password = cipher_suite.decrypt(encrypted_password.encode('utf-8'))
+def decrypt_password(encrypted_password: str, cipher: Fernet | MultiFernet = cipher_suite) -> str:
+    decrypted_password = cipher.decrypt(encrypted_password.encode('utf-8'))
     original_password = decrypted_password.decode('utf-8')
     return original_password
 
@@ -26,18 +37,22 @@ def generate_password(length_password: int = 12) -> str:
     return ''.join([secrets.choice(alphabet_password) for _ in range(length_password)])
 
 
-async def check_auth_data_by_user(session: AsyncSession, user_id: int, auth_data_id: int) -> bool:
-    """ Проверка принадлежит ли пользователю пароль по id (auth_data) """
-    query = select(password_table.c.id) \
-        .join(group_password_table, group_password_table.c.id == password_table.c.group_id) \
-        .where(and_(group_password_table.c.user_id == user_id, password_table.c.id == auth_data_id))
-    auth_data = await session.execute(query)
-    return bool(auth_data.fetchone())
+async def check_ownership(key: str, user_id: int, loader) -> bool:
+    if ownership_cache is None:
+        return bool(await loader())
+    return bool(await ownership_cache.get_or_load(f'{user_id}:{key}', loader, scope=str(user_id)))
+
+
+async def invalidate_ownership(user_id: int) -> None:
+    """ Сбросить закэшированные проверки владения после удаления групп/паролей пользователя """
+    if ownership_cache is not None:
+        await ownership_cache.invalidate(str(user_id))
 
 
+@traced('ownership')
 async def check_group_by_user(session: AsyncSession, user_id: int, group_id: int) -> bool:
     """ Проверка принадлежит ли пользователю группа по id (group_id) """
-    query = select(group_password_table.c.id) \
-        .where(and_(group_password_table.c.user_id == user_id, group_password_table.c.id == group_id))
-    auth_data = await session.execute(query)
-    return bool(auth_data.fetchone())
+    async def load() -> bool | None:
+        auth_data = await session.execute(OWNED_GROUP, {'user_id': user_id, 'group_id': group_id})
+        return True if auth_data.fetchone() else None
+    return await check_ownership(f'group:{group_id}', user_id, load)
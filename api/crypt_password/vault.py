@@ -0,0 +1,192 @@
+""" Импорт/экспорт хранилища паролей потоком: память не зависит от размера хранилища """
+import csv
+import io
+import json
+import os
+import time
+from typing import BinaryIO, Iterator, Iterable, AsyncIterator, Callable, Literal
+from urllib.parse import urlparse
+
+from pydantic import ValidationError
+from sqlalchemy import select, and_
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+from database import DATABASE_URL
+from crypt_password.keys import encrypt_rows, get_cipher, master_cipher, reencrypt_if_retired
+from crypt_password.models import group_password_table, password_table, data_key_table
+from crypt_password.queries import create_auth_data_many, BATCH_SIZE
+from crypt_password.schemas import NewAuthData, ImportResult
+from crypt_password.crypto import crypto_service
+
+VaultFormat = Literal['csv', 'ndjson']
+
+# названия колонок в экспортах браузеров (Chrome, Firefox) и менеджеров паролей (Bitwarden, 1Password ...)
+FIELD_ALIASES = {
+    'service_name': ('service_name', 'name', 'title', 'url', 'login_uri'),
+    'login': ('login', 'username', 'login_username'),
+    'password': ('password', 'login_password'),
+}
+EXPORT_FIELDS = ('group_name', 'service_name', 'login', 'password')
+EXPORT_CHUNK_ROWS = 500
+SPOOL_CHUNK_SIZE = 1 << 20  # байт открытого текста в одном токене Fernet файла фонового импорта
+
+
+def read_records(file: BinaryIO, file_format: VaultFormat) -> Iterator[dict | None]:
+    """ Построчное чтение загруженного файла, None - строка которую не удалось разобрать """
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        for record in csv.DictReader(text):
+            yield {str(key).strip().lower(): value for key, value in record.items() if key is not None}
+        return
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def normalize_record(record: dict) -> dict:
+    """ Привести запись стороннего формата к полям service_name/login/password """
+    normalized = {}
+    for field, aliases in FIELD_ALIASES.items():
+        value = next((record[alias] for alias in aliases if record.get(alias)), None)
+        if field == 'service_name' and value and '://' in value:
+            value = urlparse(value).hostname or value
+        normalized[field] = value
+    return normalized
+
+
+async def import_records(session: AsyncSession, user_id: int, group_id: int, records: Iterable[dict | None],
+                         on_progress: Callable[[ImportResult], None] | None = None) -> ImportResult:
+    """ Разбор -> валидация -> шифрование -> вставка пачками по BATCH_SIZE.
+    Владение группой должно быть проверено заранее """
+    result, batch = ImportResult(), []
+
+    async def flush():
+        encrypted = await encrypt_rows(session=session, user_id=user_id, rows=[dict(row) for row in batch])
+        created = await create_auth_data_many(session=session, user_id=user_id, rows=encrypted)
+        if len(created) < len(encrypted):
+            encrypted = await reencrypt_if_retired(session=session, user_id=user_id, rows=batch, encrypted=encrypted)
+            if encrypted is not None:
+                created.update(await create_auth_data_many(session=session, user_id=user_id, rows=encrypted))
+        result.created += len(created)
+        result.conflicts += len(batch) - len(created)
+        batch.clear()
+        if on_progress is not None:
+            on_progress(result)
+
+    for record in records:
+        result.processed += 1
+        try:
+            if record is None:
+                raise ValueError('Invalid record')
+            batch.append(NewAuthData(**normalize_record(record), group_id=group_id).dict())
+        except (ValidationError, ValueError, TypeError, AttributeError):
+            result.invalid += 1
+        if len(batch) >= BATCH_SIZE:
+            await flush()
+    if batch:
+        await flush()
+    await session.commit()
+    return result
+
+
+def spool_file(source: BinaryIO, path: str) -> None:
+    """ Загруженный файл на диск для фонового импорта: каталог общий с Celery, поэтому открытый текст
+    не пишется - куски по SPOOL_CHUNK_SIZE шифруются мастер-ключом, каждый токен на своей строке """
+    with open(path, 'wb') as target:
+        while chunk := source.read(SPOOL_CHUNK_SIZE):
+            target.write(master_cipher.encrypt(chunk) + b'\n')
+
+
+class SpooledReader(io.RawIOBase):
+    """ Чтение файла spool_file с расшифровкой по одному куску, открытый текст есть только в памяти """
+
+    def __init__(self, file: BinaryIO):
+        self._tokens = iter(file)
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._chunk:
+            token = next(self._tokens, None)
+            if token is None:
+                return 0
+            self._chunk = memoryview(master_cipher.decrypt(token.strip()))
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+def sweep_spool(directory: str, max_age: float) -> int:
+    """ Удалить файлы фонового импорта старше max_age секунд (задача Celery не выполнилась), вернуть их число """
+    removed, deadline = 0, time.time() - max_age
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file() and entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # файл уже удалила задача импорта
+    return removed
+
+
+async def import_file(user_id: int, group_id: int, path: str, file_format: VaultFormat,
+                      on_progress: Callable[[ImportResult], None] | None = None) -> ImportResult:
+    """ Импорт из файла spool_file вне HTTP запроса (Celery), со своим подключением к БД """
+    engine = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    try:
+        async with sessionmaker(engine, class_=AsyncSession)() as session:
+            query = select(group_password_table.c.id) \
+                .where(and_(group_password_table.c.id == group_id, group_password_table.c.user_id == user_id))
+            if (await session.execute(query)).scalar() is None:
+                raise ValueError(f'No found group by UserId ({user_id}) and GroupId ({group_id})')
+            with open(path, 'rb') as file:
+                records = read_records(io.BufferedReader(SpooledReader(file)), file_format)
+                return await import_records(session=session, user_id=user_id, group_id=group_id,
+                                            records=records, on_progress=on_progress)
+    finally:
+        await engine.dispose()
+
+
+async def export_rows(session: AsyncSession, user_id: int, file_format: VaultFormat,
+                      group_id: int | None = None) -> AsyncIterator[str]:
+    """ Серверный курсор -> расшифровка -> куски ответа по EXPORT_CHUNK_ROWS строк """
+    query = select(group_password_table.c.name.label('group_name'), password_table.c.service_name,
+                   password_table.c.login, password_table.c.hashed_password, password_table.c.key_id,
+                   data_key_table.c.wrapped_key) \
+        .join(password_table, password_table.c.group_id == group_password_table.c.id) \
+        .outerjoin(data_key_table, data_key_table.c.id == password_table.c.key_id) \
+        .where(password_table.c.user_id == user_id) \
+        .order_by(password_table.c.id)
+    if group_id:
+        query = query.where(password_table.c.group_id == group_id)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if file_format == 'csv':
+        writer.writerow(EXPORT_FIELDS)
+    result = await session.stream(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+    async for partition in result.partitions():
+        passwords = await crypto_service.decrypt_many([(row.hashed_password, get_cipher(row.key_id, row.wrapped_key))
+                                                       for row in partition])
+        for row, password in zip(partition, passwords):
+            values = (row.group_name, row.service_name, row.login, password)
+            if file_format == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, values)), ensure_ascii=False) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
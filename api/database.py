@@ -1,19 +1,52 @@
 from typing import AsyncGenerator
+from uuid import uuid4
+
+import asyncpg
 from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import QueuePool
 from config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, COUNT_MAX_CONNECTIONS_DB,\
-    LIVE_POOL_DB_CONNECTIONS, COUNT_OVERFLOW_POOL
+    LIVE_POOL_DB_CONNECTIONS, COUNT_OVERFLOW_POOL, DB_REPLICA_HOSTS, DB_STATEMENT_CACHE_SIZE, DB_PGBOUNCER
 
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+
+class PgBouncerConnection(asyncpg.Connection):
+    """ Уникальные имена prepared statements: PgBouncer отдает одно серверное соединение разным клиентам,
+    а счетчик имен asyncpg в каждом процессе начинается с нуля """
+
+    def _get_unique_id(self, prefix: str) -> str:
+        return f'__asyncpg_{prefix}_{uuid4().hex}__'
+
+
+def connect_args() -> dict:
+    if DB_PGBOUNCER:
+        # в режиме transaction оператор, подготовленный в одной транзакции, в следующей может оказаться
+        # на другом серверном соединении - поэтому без кэша ни у SQLAlchemy, ни у asyncpg
+        return {'prepared_statement_cache_size': 0, 'statement_cache_size': 0,
+                'connection_class': PgBouncerConnection}
+    return {'prepared_statement_cache_size': DB_STATEMENT_CACHE_SIZE}
+
+
 metadata = MetaData()
 engine = create_async_engine(DATABASE_URL, pool_size=COUNT_MAX_CONNECTIONS_DB, max_overflow=COUNT_OVERFLOW_POOL,
-                             poolclass=QueuePool, pool_recycle=LIVE_POOL_DB_CONNECTIONS)
+                             poolclass=QueuePool, pool_recycle=LIVE_POOL_DB_CONNECTIONS, connect_args=connect_args())
 async_session_maker = sessionmaker(engine, class_=AsyncSession)
 
 
+def create_replica_engine(host: str) -> AsyncEngine:
+    host, _, port = host.partition(':')
+    return create_async_engine(f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{host}:{port or DB_PORT}/{DB_NAME}",
+                               pool_size=COUNT_MAX_CONNECTIONS_DB, max_overflow=COUNT_OVERFLOW_POOL,
+                               poolclass=QueuePool, pool_recycle=LIVE_POOL_DB_CONNECTIONS,
+                               connect_args=connect_args())
+
+
+# движки реплик для чтения (replicas.py), пустой список - все запросы на primary
+replica_engines: dict[str, AsyncEngine] = {host: create_replica_engine(host) for host in DB_REPLICA_HOSTS}
+
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session
@@ -0,0 +1,149 @@
+""" Готовность воркера: прогрев до первых запросов и проверки для оркестратора.
+
+/health/live - процесс отвечает, без обращений к базе и Redis (провал - перезапустить контейнер).
+/health/ready - воркер прогрет, Postgres и Redis отвечают за HEALTH_CHECK_TIMEOUT (503 - не слать трафик).
+
+preload_modules() вызывается в мастере gunicorn до fork (main.py): метаданные phonenumbers, backend passlib
+и привязки OpenSSL из cryptography загружаются один раз, воркеры получают их готовыми. warm_up() в каждом
+воркере при старте открывает COUNT_MAX_CONNECTIONS_DB соединений пула - первые запросы после деплоя
+не ждут подключения к базе. Те же проверки ждут зависимостей при старте контейнера (docker/api.sh):
+    python api/health.py --wait 60
+"""
+import argparse
+import asyncio
+import sys
+import time
+from contextlib import AsyncExitStack
+
+import phonenumbers
+from cryptography.fernet import Fernet
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from loguru import logger
+from phonenumbers import PhoneMetadata
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from auth.hashing import pwd_context
+from config import COUNT_MAX_CONNECTIONS_DB, DB_POOL_WARM_UP, HEALTH_CHECK_TIMEOUT, REDIS_HOST, REDIS_PORT
+from database import engine
+
+router = APIRouter()
+
+SELECT_1 = text('SELECT 1')
+# брокер Celery: без него не уходят письма сброса пароля
+redis_client = Redis(host=REDIS_HOST, port=REDIS_PORT, socket_connect_timeout=HEALTH_CHECK_TIMEOUT)
+
+_warmed_up = False
+
+
+def preload_modules() -> None:
+    """ Загрузка того, что иначе подгружается лениво на первом запросе; повторный вызов ничего не делает """
+    for region in phonenumbers.SUPPORTED_REGIONS:
+        PhoneMetadata.metadata_for_region(region)
+    for country_code in phonenumbers.COUNTRY_CODES_FOR_NON_GEO_REGIONS:
+        PhoneMetadata.metadata_for_nongeo_region(country_code)
+    for scheme in pwd_context.schemes():
+        handler = pwd_context.handler(scheme)
+        if hasattr(handler, 'get_backend'):
+            handler.get_backend()
+    Fernet(Fernet.generate_key()).encrypt(b'warm-up')
+
+
+async def _open_connection(stack: AsyncExitStack) -> None:
+    conn = await stack.enter_async_context(engine.connect())
+    await conn.execute(SELECT_1)
+
+
+async def warm_up(connections: int = COUNT_MAX_CONNECTIONS_DB) -> None:
+    """ Прогрев воркера после fork: модули и соединения пула, ошибки не мешают старту """
+    global _warmed_up
+    start = time.perf_counter()
+    preload_modules()
+    opened = 0
+    if DB_POOL_WARM_UP and connections > 0:
+        # соединения при выходе возвращаются в пул, pool_size держит их открытыми. Первое открывается
+        # отдельно: событие first_connect движка держит threading-блокировку, и параллельные первые
+        # подключения из greenlet'ов одного потока ждали бы друг друга бесконечно
+        async with AsyncExitStack() as stack:
+            results = await asyncio.gather(_open_connection(stack), return_exceptions=True)
+            results += await asyncio.gather(*(_open_connection(stack) for _ in range(connections - 1)),
+                                            return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        opened = len(results) - len(errors)
+        if errors:
+            logger.warning(f'Pool warm-up: {len(errors)} of {connections} connections failed: {errors[0]!r}')
+    _warmed_up = True
+    logger.info(f'Worker warmed up in {time.perf_counter() - start:.3f}s, {opened} DB connections open')
+
+
+async def check_postgres() -> None:
+    async with engine.connect() as conn:
+        await conn.execute(SELECT_1)
+
+
+async def check_redis() -> None:
+    await redis_client.ping()
+
+
+CHECKS = {'postgres': check_postgres, 'redis': check_redis}
+
+
+async def run_checks(timeout: float = HEALTH_CHECK_TIMEOUT) -> dict[str, str]:
+    """ Проверки зависимостей параллельно: имя -> 'ok' или текст ошибки """
+    async def run(check) -> str:
+        try:
+            await asyncio.wait_for(check(), timeout)
+        except (DBAPIError, RedisError, OSError, asyncio.TimeoutError) as ex:
+            return repr(ex)
+        return 'ok'
+
+    results = await asyncio.gather(*(run(check) for check in CHECKS.values()))
+    return dict(zip(CHECKS, results))
+
+
+@router.get('/live')
+async def live():
+    return {'status': 'ok'}
+
+
+@router.get('/ready')
+async def ready():
+    checks = await run_checks()
+    is_ready = _warmed_up and all(result == 'ok' for result in checks.values())
+    return JSONResponse(status_code=200 if is_ready else 503,
+                        content={'status': 'ready' if is_ready else 'not ready', 'warmed_up': _warmed_up,
+                                 'checks': checks})
+
+
+async def wait_for_dependencies(timeout: float, interval: float) -> bool:
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            checks = await run_checks()
+            failed = {name: result for name, result in checks.items() if result != 'ok'}
+            if not failed:
+                logger.info('Dependencies are ready')
+                return True
+            if time.monotonic() >= deadline:
+                logger.error(f'Dependencies are not ready after {timeout}s: {failed}')
+                return False
+            logger.info(f'Waiting for dependencies: {failed}')
+            await asyncio.sleep(interval)
+    finally:
+        await engine.dispose()
+        await redis_client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Ожидание Postgres и Redis перед миграциями и запуском API')
+    parser.add_argument('--wait', type=float, default=60, help='секунд до отказа')
+    parser.add_argument('--interval', type=float, default=1, help='секунд между попытками')
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(wait_for_dependencies(args.wait, args.interval)) else 1)
+
+
+if __name__ == '__main__':
+    main()
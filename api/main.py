@@ -7,8 +7,14 @@ from loguru import logger
 
 from auth.endpoints import router as router_auth
 from crypt_password.endpoints import router as router_crypt
+from auth.hashing import password_hasher
+from metrics import metrics_middleware, metrics_endpoint, mark_worker_dead
+from tracing import tracing_middleware
+from replicas import replica_router, read_your_writes_middleware
+from health import router as router_health, warm_up, preload_modules
+from crypt_password.crypto import crypto_service
 from logging_settings import InterceptHandler, StubbedGunicornLogger
-from config import LOG_LEVEL, JSON_LOGS, WORKERS
+from config import LOG_LEVEL, JSON_LOGS, WORKERS, TRACING_ENABLED, DB_REPLICA_HOSTS
 
 app = FastAPI(
     title="Passwords Manager App"
@@ -21,6 +27,25 @@ async def start_page():
 
 app.include_router(router_auth, tags=["Auth"], prefix="/auth")
 app.include_router(router_crypt, tags=["Crypt Password"], prefix="/crypt")
+app.include_router(router_health, prefix="/health", include_in_schema=False)
+app.middleware("http")(metrics_middleware)
+if TRACING_ENABLED:
+    app.middleware("http")(tracing_middleware)
+if DB_REPLICA_HOSTS:
+    app.middleware("http")(read_your_writes_middleware)
+app.add_api_route("/metrics", metrics_endpoint, include_in_schema=False)
+
+
+@app.on_event("startup")
+async def warm_up_worker():
+    await warm_up()
+
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    password_hasher.shutdown()
+    crypto_service.shutdown()
+    await replica_router.close()
 
 
 class StandaloneApplication(BaseApplication):
@@ -71,7 +96,10 @@ if __name__ == '__main__':
         "accesslog": "-",
         "errorlog": "-",
         "worker_class": "uvicorn.workers.UvicornWorker",
-        "logger_class": StubbedGunicornLogger
+        "logger_class": StubbedGunicornLogger,
+        "child_exit": mark_worker_dead,
     }
 
+    # загруженное в мастере до fork воркеры получают готовым
+    preload_modules()
     StandaloneApplication(app, options).run()
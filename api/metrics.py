@@ -0,0 +1,93 @@
+""" Метрики Prometheus (/metrics).
+
+При запуске под gunicorn с несколькими воркерами задается PROMETHEUS_MULTIPROC_DIR (см. docker/api.sh):
+каждый процесс пишет значения в свои файлы, а /metrics собирает их со всех воркеров.
+Метрики объявлены рядом с кодом, который их пишет:
+- password_hash_seconds (auth/hashing.py) - bcrypt, число операций и длительность
+- password_rehash_total (auth/hashing.py) - хэши, обновленные при входе до текущей схемы/стоимости
+- crypto_seconds, crypto_operations_total (crypt_password/crypto.py) - Fernet
+- rate_limit_requests_total, rate_limit_seconds (auth/rate_limit.py) - решения ограничителя входа
+- db_read_sessions_total, db_replica_healthy, db_replica_lag_seconds (replicas.py) - чтение с реплик
+- cache_requests_total (cache.py) - попадания/промахи кэшей, доля попаданий считается в PromQL
+"""
+import time
+
+from celery.signals import before_task_publish, after_task_publish
+from fastapi import Request, Response
+from prometheus_client import Histogram, Gauge, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest, multiprocess, \
+    REGISTRY
+from sqlalchemy import event
+
+from config import PROMETHEUS_MULTIPROC_DIR
+from database import engine
+
+request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency by route template',
+                             ['method', 'route', 'status'])
+celery_enqueue_duration = Histogram('celery_enqueue_seconds', 'Time to publish a Celery task to the broker',
+                                    ['task'])
+
+# livesum - сумма по живым воркерам gunicorn
+db_pool_checked_out = Gauge('db_pool_checked_out', 'Connections checked out of the SQLAlchemy pool',
+                            multiprocess_mode='livesum')
+db_pool_overflow = Gauge('db_pool_overflow', 'Overflow connections opened above pool_size',
+                         multiprocess_mode='livesum')
+db_pool_size = Gauge('db_pool_size', 'Configured SQLAlchemy pool size', multiprocess_mode='livesum')
+
+
+def _update_pool_gauges(*args) -> None:
+    pool = engine.sync_engine.pool
+    db_pool_checked_out.set(pool.checkedout())
+    db_pool_overflow.set(max(pool.overflow(), 0))
+    db_pool_size.set(pool.size())
+
+
+for pool_event in ('checkout', 'checkin', 'close'):
+    event.listen(engine.sync_engine.pool, pool_event, _update_pool_gauges)
+
+
+_publish_started: dict[str, float] = {}
+
+
+@before_task_publish.connect
+def _before_task_publish(sender: str | None = None, headers: dict | None = None, **kwargs) -> None:
+    _publish_started[headers.get('id')] = time.perf_counter()
+
+
+@after_task_publish.connect
+def _after_task_publish(sender: str | None = None, headers: dict | None = None, **kwargs) -> None:
+    started = _publish_started.pop(headers.get('id'), None)
+    if started is not None:
+        celery_enqueue_duration.labels(sender).observe(time.perf_counter() - started)
+
+
+def _route_template(request: Request) -> str:
+    # шаблон пути, а не сам путь, иначе /import_vault/{task_id} даст по серии на каждую задачу.
+    # Маршрут уже найден роутером (APIRoute кладет его в scope), без маршрута - одна метка на все 404
+    route = request.scope.get('route')
+    return route.path if route is not None else 'unmatched'
+
+
+async def metrics_middleware(request: Request, call_next) -> Response:
+    start, status_code = time.perf_counter(), 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        request_duration.labels(request.method, _route_template(request), status_code) \
+            .observe(time.perf_counter() - start)
+
+
+def metrics_endpoint() -> Response:
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_worker_dead(server, worker) -> None:
+    """ gunicorn child_exit: убрать livesum значения завершившегося воркера """
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,204 @@
+""" Чтение с реплик: сессии read-only ендпоинтов (get_read_session) по кругу на живых репликах DB_REPLICA_HOSTS.
+
+Фоновая проверка раз в DB_REPLICA_CHECK_INTERVAL исключает недоступные реплики и отстающие больше
+DB_REPLICA_MAX_LAG, без живых реплик чтение идет на primary. Запрос, в котором был commit, помечает
+пользователя, и READ_YOUR_WRITES_WINDOW секунд его чтения тоже идут на primary - иначе только что
+созданная запись могла бы еще не дойти до реплики. Метка хранится в Redis, чтобы ее видели все воркеры.
+Без DB_REPLICA_HOSTS get_read_session отдает ту же сессию primary, что и get_async_session.
+"""
+import asyncio
+import itertools
+from contextvars import ContextVar
+from typing import AsyncGenerator
+
+from fastapi import Depends, Request, Response
+from jose import JWTError
+from loguru import logger
+from prometheus_client import Counter, Gauge
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+
+from cache import TTLCache
+from config import DB_REPLICA_CHECK_INTERVAL, DB_REPLICA_MAX_LAG, READ_YOUR_WRITES_WINDOW, REDIS_HOST, REDIS_PORT, \
+    REDIS_CACHE_DB
+from database import get_async_session, replica_engines
+from auth.utils import decode_token
+
+read_sessions = Counter('db_read_sessions_total', 'Sessions of read-only endpoints by target',
+                        ['target'])  # replica | primary (нет живых реплик) | recent_write
+replica_healthy = Gauge('db_replica_healthy', 'Replica is used for reads', ['replica'], multiprocess_mode='livemax')
+replica_lag = Gauge('db_replica_lag_seconds', 'Replication lag at the last health check', ['replica'],
+                    multiprocess_mode='livemax')
+
+# на простаивающем primary время последней транзакции растет, поэтому догнавшая реплика - без отставания
+LAG_QUERY = text("SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() "
+                 "THEN 0 ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END")
+
+_request_writes: ContextVar[dict | None] = ContextVar('request_writes', default=None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_commit(session: Session) -> None:
+    writes = _request_writes.get()
+    if writes is not None:
+        writes['committed'] = True
+
+
+class Replica:
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.session_maker = sessionmaker(engine, class_=AsyncSession)
+        # до первой проверки чтение идет на primary
+        self.healthy = False
+        event.listen(engine.sync_engine, 'handle_error', self._on_error)
+
+    def _on_error(self, context) -> None:
+        # разрыв или отказ в соединении посреди запроса - не ждать следующей проверки
+        if context.is_disconnect or context.connection is None:
+            self.set_healthy(False, f'connection error: {context.original_exception}')
+
+    def set_healthy(self, healthy: bool, reason: str) -> None:
+        if healthy != self.healthy:
+            (logger.info if healthy else logger.warning)(f'Replica {self.name} {"up" if healthy else "down"}: {reason}')
+        self.healthy = healthy
+        replica_healthy.labels(self.name).set(int(healthy))
+
+    async def _lag(self) -> float | None:
+        async with self.engine.connect() as conn:
+            return (await conn.execute(LAG_QUERY)).scalar()
+
+    async def check(self, max_lag: float, timeout: float) -> None:
+        try:
+            lag = await asyncio.wait_for(self._lag(), timeout)
+        except (DBAPIError, OSError, asyncio.TimeoutError) as ex:
+            self.set_healthy(False, repr(ex))
+            return
+        lag = float(lag) if lag is not None else float('inf')
+        replica_lag.labels(self.name).set(lag)
+        self.set_healthy(lag <= max_lag, f'lag {lag:.3f}s')
+
+
+class ReplicaRouter:
+    """ Выбор базы для сессии чтения: primary после недавних изменений пользователя, иначе реплика по кругу """
+
+    def __init__(self, engines: dict[str, AsyncEngine], client: Redis | None, check_interval: float,
+                 max_lag: float, window: float):
+        self.replicas = [Replica(name, engine) for name, engine in engines.items()]
+        self.client = client
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self.window = window
+        # свои изменения процесс видит без обращения к Redis
+        self.recent_writes = TTLCache(name='recent_writes', maxsize=4096, ttl=window)
+        self._counter = itertools.count()
+        self._checker: asyncio.Task | None = None
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return f'recent_write:{username}'
+
+    async def mark_write(self, username: str) -> None:
+        self.recent_writes.set(username, True)
+        if self.client is None:
+            return
+        try:
+            await self.client.set(self._key(username), 1, px=int(self.window * 1000))
+        except RedisError as ex:
+            logger.warning(f'Read-your-writes mark for {username} not saved: {ex}')
+
+    async def recent_write(self, username: str) -> bool:
+        if self.recent_writes.get(username):
+            return True
+        if self.client is None:
+            return False
+        try:
+            return await self.client.exists(self._key(username)) > 0
+        except RedisError as ex:
+            # без метки нельзя исключить свежие изменения - читать с primary
+            logger.warning(f'Read-your-writes check unavailable: {ex}')
+            return True
+
+    async def check(self) -> None:
+        await asyncio.gather(*(replica.check(self.max_lag, self.check_interval) for replica in self.replicas))
+
+    async def _check_loop(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    async def session_maker(self, username: str | None) -> sessionmaker | None:
+        """ sessionmaker реплики, None - читать с primary """
+        if not self.replicas:
+            return None
+        # проверка запускается в воркере при первом чтении, уже после fork
+        if self._checker is None or self._checker.done():
+            self._checker = asyncio.create_task(self._check_loop())
+        if username and await self.recent_write(username):
+            read_sessions.labels('recent_write').inc()
+            return None
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            read_sessions.labels('primary').inc()
+            return None
+        read_sessions.labels('replica').inc()
+        return healthy[next(self._counter) % len(healthy)].session_maker
+
+    async def close(self) -> None:
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+        if self.client is not None:
+            await self.client.close()
+
+
+replica_router = ReplicaRouter(
+    engines=replica_engines, client=Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_CACHE_DB) if replica_engines
+    else None, check_interval=DB_REPLICA_CHECK_INTERVAL, max_lag=DB_REPLICA_MAX_LAG, window=READ_YOUR_WRITES_WINDOW)
+
+
+def request_username(request: Request) -> str | None:
+    """ Чьи данные читает или меняет запрос: username из пути, иначе владелец Bearer токена """
+    username = request.path_params.get('username')
+    if username:
+        return username
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        return decode_token(token).get('sub')
+    except JWTError:
+        return None
+
+
+async def get_read_session(request: Request, session: AsyncSession = Depends(get_async_session)) \
+        -> AsyncGenerator[AsyncSession, None]:
+    """ Сессия только для чтения: реплика или (без реплик/после изменений) та же сессия primary """
+    session_maker = await replica_router.session_maker(request_username(request))
+    if session_maker is None:
+        yield session
+        return
+    async with session_maker() as replica_session:
+        yield replica_session
+
+
+async def read_your_writes_middleware(request: Request, call_next) -> Response:
+    writes = {'committed': False}
+    # contextvar копируется в задачу обработчика, словарь у них общий
+    token = _request_writes.set(writes)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_writes.reset(token)
+    if writes['committed']:
+        username = request_username(request)
+        if username:
+            # до отправки ответа: следующий запрос клиента уже увидит метку
+            await replica_router.mark_write(username)
+    return response
@@ -0,0 +1,82 @@
+""" Тайминги этапов запроса: span('name') внутри запроса, итог - заголовок Server-Timing и поля лога.
+
+При выключенном TRACING_ENABLED middleware не подключается, а span() сводится к чтению contextvar.
+"""
+import functools
+import time
+from contextvars import ContextVar
+
+from fastapi import Request, Response
+from loguru import logger
+
+_timings: ContextVar[dict[str, float] | None] = ContextVar('timings', default=None)
+
+
+class _Span:
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name: str, timings: dict[str, float]):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> bool:
+        self.timings[self.name] = self.timings.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+_noop_span = _NoopSpan()
+
+
+def span(name: str) -> _Span | _NoopSpan:
+    """ Время блока with span(name) прибавляется к этапу name текущего запроса """
+    timings = _timings.get()
+    if timings is None:
+        return _noop_span
+    return _Span(name, timings)
+
+
+def traced(name: str):
+    """ span на весь вызов асинхронной функции """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _timings.get() is None:
+                return await func(*args, **kwargs)
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    return ', '.join(f'{name};dur={duration * 1000:.3f}' for name, duration in timings.items())
+
+
+async def tracing_middleware(request: Request, call_next) -> Response:
+    timings = {}
+    # contextvar копируется в задачи обработчика, но словарь у них общий
+    token = _timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _timings.reset(token)
+    timings['total'] = time.perf_counter() - start
+    response.headers['Server-Timing'] = server_timing(timings)
+    logger.bind(method=request.method, path=request.url.path, status=response.status_code,
+                timings={name: round(duration * 1000, 3) for name, duration in timings.items()}) \
+        .debug('Request timings')
+    return response
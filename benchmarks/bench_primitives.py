@@ -0,0 +1,115 @@
+""" Микробенчмарки CPU-функций, выполняемых на каждом запросе (pytest-benchmark).
+
+Все замеры в одной группе и отсортированы по среднему времени, сверху - самые дешевые:
+    ENV_FILE='.env.test' pytest benchmarks/bench_primitives.py --benchmark-sort=mean --benchmark-columns=mean,median,ops
+Сохранить/сравнить результаты между коммитами: --benchmark-autosave / --benchmark-compare
+test_build_query_*: построение оператора и ключа кэша компиляции - то, что SQLAlchemy делает перед
+выполнением (сам SQL берется из кэша engine)
+"""
+from datetime import timedelta
+
+import pytest
+from jose import jwt
+from sqlalchemy import select
+
+from config import JWT_SECRET_KEY, JWT_ALGORITHM
+from auth.hashing import _hash, _verify
+from auth.schemas import CreateUser
+from auth.utils import AuthHelper
+from auth.validators import valid_email, valid_phone, valid_username, valid_password
+from crypt_password.schemas import NewAuthData, UpdateAuthData, SearchData
+from crypt_password.utils import encrypt_password, decrypt_password, generate_password
+from crypt_password.models import group_password_table, password_table
+from crypt_password.queries import AUTH_DATA_GROUPS
+
+pytestmark = pytest.mark.benchmark(group='per-request CPU')
+
+USER = {'email': 'benchmark@mail.ru', 'username': 'benchmark', 'password': 'Admin1$3adsfas',
+        'confirmed_password': 'Admin1$3adsfas', 'phone': '+79001002344'}
+TOKEN = AuthHelper.create_access_token(data={'sub': 'benchmark'}, expires_delta=timedelta(minutes=60))
+ENCRYPTED = encrypt_password(original_password='password')
+HASHED = _hash('Admin1$3adsfas')
+
+
+def test_encrypt_password(benchmark):
+    benchmark(encrypt_password, original_password='password')
+
+
+def test_decrypt_password(benchmark):
+    assert benchmark(decrypt_password, encrypted_password=ENCRYPTED) == 'password'
+
+
+def test_generate_password(benchmark):
+    benchmark(generate_password, length_password=12)
+
+
+def test_bcrypt_hash_password(benchmark):
+    # то, что AuthHelper.hash_password выполняет в пуле воркеров; bcrypt медленный, поэтому мало раундов
+    benchmark.pedantic(_hash, args=('Admin1$3adsfas',), rounds=5, iterations=1)
+
+
+def test_bcrypt_verify_password(benchmark):
+    assert benchmark.pedantic(_verify, args=('Admin1$3adsfas', HASHED), rounds=5, iterations=1)
+
+
+def test_create_access_token(benchmark):
+    benchmark(AuthHelper.create_access_token, data={'sub': 'benchmark'}, expires_delta=timedelta(minutes=60))
+
+
+def test_jwt_decode(benchmark):
+    assert benchmark(jwt.decode, TOKEN, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])['sub'] == 'benchmark'
+
+
+def test_valid_email(benchmark):
+    benchmark(valid_email, USER['email'])
+
+
+def test_valid_phone(benchmark):
+    benchmark(valid_phone, USER['phone'])
+
+
+def test_valid_username(benchmark):
+    benchmark(valid_username, USER['username'])
+
+
+def test_valid_password(benchmark):
+    benchmark(valid_password, USER['password'])
+
+
+def test_schema_create_user(benchmark):
+    benchmark(CreateUser, **USER)
+
+
+def test_schema_new_auth_data(benchmark):
+    benchmark(NewAuthData, service_name='GitHub', login='Benchmark', password='password', group_id=1)
+
+
+def test_schema_update_auth_data(benchmark):
+    benchmark(UpdateAuthData, id=1, login='Benchmark', password='password')
+
+
+def test_schema_search_data(benchmark):
+    benchmark(SearchData, service_name='git', mode='prefix')
+
+
+def build_auth_data_groups(user_id: int, after_id: int, limit: int):
+    # get_data_groups до AUTH_DATA_GROUPS: выражение собиралось на каждый запрос
+    return select(group_password_table.c.id.label('group_id'),
+                  group_password_table.c.name.label('group_name'),
+                  group_password_table.c.description.label('group_description'),
+                  password_table.c.id.label('auth_data_id'),
+                  password_table.c.service_name,
+                  password_table.c.login) \
+        .join(password_table, password_table.c.group_id == group_password_table.c.id) \
+        .where(password_table.c.user_id == user_id) \
+        .where(password_table.c.id > after_id) \
+        .order_by(password_table.c.id) \
+        .limit(limit)
+
+
+def test_build_query_per_request(benchmark):
+    benchmark(lambda: build_auth_data_groups(1, 100, 50)._generate_cache_key())
+
+
+def test_build_query_prebuilt(benchmark):
+    benchmark(lambda: AUTH_DATA_GROUPS._generate_cache_key())
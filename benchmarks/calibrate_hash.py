@@ -0,0 +1,88 @@
+""" Подбор стоимости хэширования паролей под целевое время входа на текущей машине.
+
+Замеряет bcrypt при росте rounds (и argon2 при росте time_cost, если установлен argon2-cffi)
+и печатает переменные окружения для самой дорогой настройки, укладывающейся в --target-ms:
+    ENV_FILE='.env' python benchmarks/calibrate_hash.py --target-ms 250
+Пропускная способность входа на один воркер ~ HASH_WORKERS / время хэша.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+from passlib.context import CryptContext  # noqa: E402
+from passlib.exc import MissingBackendError  # noqa: E402
+
+from config import HASH_WORKERS  # noqa: E402
+
+PASSWORD = 'Calibrate1$password'
+
+
+def measure(context: CryptContext, repeat: int) -> float:
+    """ Медиана времени verify, секунды (вход - это verify, hash выполняется только при регистрации) """
+    hashed = context.hash(PASSWORD)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        context.verify(PASSWORD, hashed)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(name: str, make_context, costs, target: float, repeat: int) -> tuple[int, float] | None:
+    """ Наибольшая стоимость из costs, время которой не больше target; costs перебираются по возрастанию """
+    best = None
+    for cost in costs:
+        elapsed = measure(make_context(cost), repeat)
+        print(f'{name:<7} cost={cost:<3} {elapsed * 1000:8.1f} ms')
+        if elapsed > target:
+            break
+        best = cost, elapsed
+    return best
+
+
+def report(settings: dict[str, int], elapsed: float, workers: int) -> None:
+    for key, value in settings.items():
+        print(f'{key}={value}')
+    print(f'# ~{elapsed * 1000:.0f} ms per login, ~{workers / elapsed:.1f} logins/s per API worker '
+          f'(HASH_WORKERS={workers})\n')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--target-ms', type=float, default=250, help='целевое время проверки пароля')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=HASH_WORKERS, help='HASH_WORKERS для оценки пропускной способности')
+    parser.add_argument('--argon2-memory', type=int, default=65536, help='ARGON2_MEMORY_COST, KiB')
+    parser.add_argument('--argon2-parallelism', type=int, default=1)
+    args = parser.parse_args()
+    target = args.target_ms / 1000
+
+    best = calibrate('bcrypt', lambda rounds: CryptContext(schemes=['bcrypt'], bcrypt__rounds=rounds),
+                     range(10, 20), target, args.repeat)
+    print()
+    if best is None:
+        print('# bcrypt: even rounds=10 is slower than the target\n')
+    else:
+        report({'BCRYPT_ROUNDS': best[0]}, best[1], args.workers)
+
+    try:
+        best = calibrate('argon2', lambda time_cost: CryptContext(
+            schemes=['argon2'], argon2__time_cost=time_cost, argon2__memory_cost=args.argon2_memory,
+            argon2__parallelism=args.argon2_parallelism), range(1, 11), target, args.repeat)
+    except MissingBackendError:
+        print('# argon2: argon2-cffi is not installed')
+        return
+    print()
+    if best is None:
+        print(f'# argon2: time_cost=1 with {args.argon2_memory} KiB is slower than the target, lower --argon2-memory')
+    else:
+        report({'PASSWORD_SCHEMES': 'argon2,bcrypt', 'ARGON2_TIME_COST': best[0],
+                'ARGON2_MEMORY_COST': args.argon2_memory, 'ARGON2_PARALLELISM': args.argon2_parallelism},
+               best[1], args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+""" Нагрузочный тест основных ендпоинтов: p50/p95/p99 и req/s, сохранение и сравнение JSON baseline.
+
+База (из ENV_FILE) заполняется пользователями bench_user_*, их группами и паролями, затем каждый
+ендпоинт по очереди нагружается фиксированным числом параллельных клиентов.
+
+Запуск против поднятого сервиса:
+    ENV_FILE='.env' python benchmarks/load_test.py --base-url http://localhost:8000 --save benchmarks/results/base.json
+(у сервиса должен быть выключен RATE_LIMIT_ENABLED, иначе login упрется в ограничение по IP)
+В одном процессе через ASGI (без сети и gunicorn), сравнение с сохраненным baseline:
+    ENV_FILE='.env.test' python benchmarks/load_test.py --asgi --compare benchmarks/results/base.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+# с --asgi login гоняется с одного адреса, ограничитель частоты входа отклонил бы почти все запросы
+os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+
+import httpx  # noqa: E402
+from loguru import logger  # noqa: E402
+from sqlalchemy import insert, delete  # noqa: E402
+
+from database import engine, metadata  # noqa: E402
+from auth.models import user as user_model  # noqa: E402
+from auth.hashing import pwd_context  # noqa: E402
+from crypt_password.models import group_password_table, password_table  # noqa: E402
+from crypt_password.utils import encrypt_password  # noqa: E402
+
+USER_PREFIX = 'bench_user_'
+USER_PASSWORD = 'Bench1$password'
+BATCH_SIZE = 1000
+ENDPOINTS = ('login', 'create_auth_data', 'search_auth_data', 'decrypt_password')
+
+
+async def seed(users: int, groups: int, entries: int) -> dict[str, dict]:
+    """ Пересоздать тестовых пользователей, вернуть username -> {group_ids, auth_data_ids} """
+    hashed_password = pwd_context.hash(USER_PASSWORD)  # bcrypt один раз на всех пользователей
+    async with engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.execute(delete(user_model).where(user_model.c.username.like(f'{USER_PREFIX}%')))
+        result = await conn.execute(insert(user_model).returning(user_model.c.id, user_model.c.username),
+                                    [{'email': f'{USER_PREFIX}{i}@bench.local', 'username': f'{USER_PREFIX}{i}',
+                                      'password': hashed_password, 'is_active': True} for i in range(users)])
+        seeded = {row.username: {'id': row.id, 'group_ids': [], 'auth_data_ids': []} for row in result}
+        by_id = {data['id']: data for data in seeded.values()}
+
+        result = await conn.execute(
+            insert(group_password_table).returning(group_password_table.c.id, group_password_table.c.user_id),
+            [{'name': f'group{g}', 'user_id': data['id']} for data in seeded.values() for g in range(groups)])
+        group_owner = {}
+        for row in result:
+            by_id[row.user_id]['group_ids'].append(row.id)
+            group_owner[row.id] = row.user_id
+
+        encrypted = encrypt_password(original_password='password')
+        rows = [{'service_name': f'service{e}', 'login': f'login{e}', 'hashed_password': encrypted,
+                 'group_id': group_id, 'user_id': user_id}
+                for group_id, user_id in group_owner.items() for e in range(entries)]
+        for start in range(0, len(rows), BATCH_SIZE):
+            result = await conn.execute(insert(password_table).returning(password_table.c.id,
+                                                                         password_table.c.group_id),
+                                        rows[start:start + BATCH_SIZE])
+            for row in result:
+                by_id[group_owner[row.group_id]]['auth_data_ids'].append(row.id)
+    return seeded
+
+
+def percentile(latencies: list[float], value: float) -> float:
+    index = min(int(round(value / 100 * (len(latencies) - 1))), len(latencies) - 1)
+    return latencies[index]
+
+
+async def drive(client: httpx.AsyncClient, make_request, requests: int, concurrency: int) -> dict:
+    """ concurrency клиентов выполняют requests запросов, make_request(i) -> (method, url, kwargs) """
+    latencies, errors, counter = [], 0, iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {'requests': requests, 'errors': errors, 'rps': round(requests / elapsed, 1),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 3)}
+
+
+async def run(args: argparse.Namespace) -> dict:
+    seeded = await seed(args.users, args.groups, args.entries)
+    if args.asgi:
+        from main import app
+        transport = httpx.ASGITransport(app=app)
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.concurrency))
+    async with httpx.AsyncClient(transport=transport, base_url=args.base_url, timeout=60) as client:
+        tokens = {}
+        for username in seeded:
+            response = await client.post('/auth/login', data={'username': username, 'password': USER_PASSWORD})
+            response.raise_for_status()
+            tokens[username] = f'Bearer {response.json()["access_token"]}'
+        usernames = list(seeded)
+        names = (f'load{int(time.time())}_{i}' for i in itertools.count())
+
+        def login(i):
+            return 'POST', '/auth/login', {'data': {'username': random.choice(usernames), 'password': USER_PASSWORD}}
+
+        def create_auth_data(i):
+            username = random.choice(usernames)
+            return 'POST', '/crypt/create_auth_data', {
+                'headers': {'Authorization': tokens[username]},
+                'json': {'service_name': next(names), 'login': 'login', 'password': 'password',
+                         'group_id': random.choice(seeded[username]['group_ids'])}}
+
+        def search_auth_data(i):
+            username = random.choice(usernames)
+            return 'POST', '/crypt/search_auth_data', {
+                'headers': {'Authorization': tokens[username]},
+                'json': {'service_name': f'service{random.randrange(args.entries)}', 'mode': 'prefix'}}
+
+        def decrypt_password(i):
+            username = random.choice(usernames)
+            return 'GET', '/crypt/decrypt_password', {
+                'headers': {'Authorization': tokens[username]},
+                'params': {'auth_data_id': random.choice(seeded[username]['auth_data_ids'])}}
+
+        requests = {'login': login, 'create_auth_data': create_auth_data, 'search_auth_data': search_auth_data,
+                    'decrypt_password': decrypt_password}
+        results = {}
+        for name in args.endpoints:
+            # login упирается в bcrypt, поэтому гоняется меньшим числом запросов
+            count = max(args.requests // 10, args.concurrency) if name == 'login' else args.requests
+            await drive(client, requests[name], min(count, args.warmup), args.concurrency)
+            results[name] = await drive(client, requests[name], count, args.concurrency)
+            print(f'{name:<18} ' + '  '.join(f'{key}={value}' for key, value in results[name].items()))
+
+    async with engine.begin() as conn:
+        await conn.execute(delete(user_model).where(user_model.c.username.like(f'{USER_PREFIX}%')))
+    await engine.dispose()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str, max_regression: float) -> bool:
+    """ Печать изменения p95 и req/s относительно baseline, False при регрессии больше max_regression % """
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    print(f'\ncompared with {baseline_path} (commit {baseline["meta"].get("commit")})')
+    ok = True
+    for name, result in results.items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        p95_change = (result['p95_ms'] / base['p95_ms'] - 1) * 100
+        rps_change = (result['rps'] / base['rps'] - 1) * 100
+        regression = p95_change > max_regression or -rps_change > max_regression
+        ok &= not regression
+        print(f'{name:<18} p95 {p95_change:+7.1f}%  rps {rps_change:+7.1f}%' + ('  REGRESSION' if regression else ''))
+    return ok
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--base-url', default='http://test')
+    parser.add_argument('--asgi', action='store_true', help='приложение в этом же процессе, без сети')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--groups', type=int, default=5, help='групп на пользователя')
+    parser.add_argument('--entries', type=int, default=50, help='паролей в группе')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=2000, help='запросов на ендпоинт')
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='сохранить результаты в JSON')
+    parser.add_argument('--compare', help='сравнить с сохраненным JSON')
+    parser.add_argument('--max-regression', type=float, default=10.0, help='допустимое ухудшение, %%')
+    args = parser.parse_args()
+    if not args.asgi and args.base_url == 'http://test':
+        parser.error('--base-url is required without --asgi')
+    random.seed(args.seed)
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    results = asyncio.run(run(args))
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        meta = {'commit': git_commit(), 'date': datetime.utcnow().isoformat(),
+                'params': {key: value for key, value in vars(args).items() if key not in ('save', 'compare')}}
+        with open(args.save, 'w') as file:
+            json.dump({'meta': meta, 'results': results}, file, indent=2)
+    if args.compare and not compare(results, args.compare, args.max_regression):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
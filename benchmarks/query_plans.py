@@ -0,0 +1,180 @@
+""" Планы запросов владельца на прежней и текущей схеме group/auth_data при 1M+ записей.
+
+В базе (из ENV_FILE) создаются схемы bench_old - составные первичные ключи, владелец только в group -
+и bench_new - таблицы из crypt_password/models.py, auth_data секционирована по user_id (в плане видно,
+что читается одна секция). Обе заполняются одинаковыми данными, после
+VACUUM ANALYZE для каждого запроса печатаются узлы плана (Index Only Scan и т.д.), время выполнения
+и число прочитанных страниц:
+    ENV_FILE='.env.test' python benchmarks/query_plans.py --users 10000 --groups 5 --entries 20
+--keep оставляет схемы для ручного EXPLAIN, без него они удаляются.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+from sqlalchemy import MetaData, text  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine  # noqa: E402
+
+from database import DATABASE_URL, metadata  # noqa: E402
+import auth.models  # noqa: E402, F401
+from crypt_password.models import AUTH_DATA_PARTITIONS  # noqa: E402
+
+OLD_SCHEMA = """
+CREATE TABLE bench_old."user" (id integer PRIMARY KEY);
+CREATE TABLE bench_old."group" (
+    id integer GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    name varchar(512) NOT NULL,
+    description varchar(2048),
+    user_id integer NOT NULL REFERENCES bench_old."user" (id) ON DELETE CASCADE,
+    PRIMARY KEY (name, user_id)
+);
+CREATE TABLE bench_old.auth_data (
+    id integer GENERATED BY DEFAULT AS IDENTITY UNIQUE,
+    service_name varchar(512) NOT NULL,
+    login varchar(128) NOT NULL,
+    hashed_password varchar(2048) NOT NULL,
+    group_id integer NOT NULL REFERENCES bench_old."group" (id) ON DELETE CASCADE,
+    key_id integer,
+    PRIMARY KEY (service_name, login, group_id)
+);
+"""
+
+# одинаковые данные в обеих схемах, шифротекст - строка длины настоящего Fernet токена
+FILL = """
+INSERT INTO {schema}."group" (id, name, user_id)
+    SELECT g, 'group' || g, (g - 1) / {groups} + 1 FROM generate_series(1, {users} * {groups}) g;
+INSERT INTO {schema}.auth_data (id, service_name, login, hashed_password, group_id{user_column})
+    SELECT e, 'service' || e, 'login' || e % {entries}, repeat('x', 120), (e - 1) / {entries} + 1{user_value}
+    FROM generate_series(1, {users} * {groups} * {entries}) e;
+"""
+
+QUERIES = {
+    'check_auth_data_by_user': (
+        'SELECT a.id FROM bench_old.auth_data a JOIN bench_old."group" g ON g.id = a.group_id '
+        'WHERE g.user_id = :user_id AND a.id = :auth_data_id',
+        'SELECT id FROM bench_new.auth_data WHERE user_id = :user_id AND id = :auth_data_id'),
+    'check_group_by_user': (
+        'SELECT id FROM bench_old."group" WHERE user_id = :user_id AND id = :group_id',
+        'SELECT id FROM bench_new."group" WHERE user_id = :user_id AND id = :group_id'),
+    'get_all_my_groups': (
+        'SELECT id, name, description FROM bench_old."group" WHERE user_id = :user_id ORDER BY id LIMIT 50',
+        'SELECT id, name, description FROM bench_new."group" WHERE user_id = :user_id ORDER BY id LIMIT 50'),
+    'get_all_auth_data_by_group': (
+        'SELECT a.id, a.service_name, a.login FROM bench_old.auth_data a '
+        'JOIN bench_old."group" g ON g.id = a.group_id WHERE g.user_id = :user_id AND g.id = :group_id '
+        'ORDER BY a.id LIMIT 50',
+        'SELECT id, service_name, login FROM bench_new.auth_data WHERE user_id = :user_id AND group_id = :group_id '
+        'ORDER BY id LIMIT 50'),
+    'get_all_my_auth_data': (
+        'SELECT g.id, g.name, a.id, a.service_name, a.login FROM bench_old."group" g '
+        'JOIN bench_old.auth_data a ON a.group_id = g.id WHERE g.user_id = :user_id ORDER BY a.id LIMIT 50',
+        'SELECT g.id, g.name, a.id, a.service_name, a.login FROM bench_new."group" g '
+        'JOIN bench_new.auth_data a ON a.group_id = g.id WHERE a.user_id = :user_id ORDER BY a.id LIMIT 50'),
+    'delete_auth_data_by_user': (
+        'DELETE FROM bench_old.auth_data a USING bench_old."group" g '
+        'WHERE a.id = :auth_data_id AND a.group_id = g.id AND g.user_id = :user_id RETURNING a.id',
+        'DELETE FROM bench_new.auth_data WHERE id = :auth_data_id AND user_id = :user_id RETURNING id'),
+}
+
+
+def plan_nodes(plan: dict) -> list[str]:
+    name = plan['Node Type'] + (f' ({plan["Index Name"]})' if 'Index Name' in plan else '')
+    return [name] + [node for child in plan.get('Plans', []) for node in plan_nodes(child)]
+
+
+async def prepare(engine, users: int, groups: int, entries: int) -> None:
+    params = {'users': users, 'groups': groups, 'entries': entries}
+    async with engine.begin() as conn:
+        for schema in ('bench_old', 'bench_new'):
+            await conn.execute(text(f'DROP SCHEMA IF EXISTS {schema} CASCADE'))
+            await conn.execute(text(f'CREATE SCHEMA {schema}'))
+        for statement in OLD_SCHEMA.split(';'):
+            if statement.strip():
+                await conn.execute(text(statement))
+        new_metadata = MetaData(schema='bench_new')
+        for table in metadata.sorted_tables:
+            table.to_metadata(new_metadata)
+        await conn.run_sync(new_metadata.create_all)
+        # DDL-события секций to_metadata не копирует
+        for remainder in range(AUTH_DATA_PARTITIONS):
+            await conn.execute(text(f'CREATE TABLE bench_new.auth_data_p{remainder} PARTITION OF bench_new.auth_data '
+                                    f'FOR VALUES WITH (MODULUS {AUTH_DATA_PARTITIONS}, REMAINDER {remainder})'))
+
+        await conn.execute(text(f'INSERT INTO bench_old."user" (id) SELECT generate_series(1, {users})'))
+        await conn.execute(text(f"INSERT INTO bench_new.\"user\" (id, email, username, password) "
+                                f"SELECT u, 'user' || u, 'user' || u, '' FROM generate_series(1, {users}) u"))
+        for schema, user_column, user_value in (('bench_old', '', ''),
+                                                ('bench_new', ', user_id', f', (e - 1) / {entries * groups} + 1')):
+            start = time.perf_counter()
+            for statement in FILL.format(schema=schema, user_column=user_column, user_value=user_value,
+                                         **params).split(';'):
+                if statement.strip():
+                    await conn.execute(text(statement))
+            print(f'{schema}: filled in {time.perf_counter() - start:.1f}s')
+    # index-only scan не читает таблицу только для страниц, отмеченных в visibility map
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        for schema in ('bench_old', 'bench_new'):
+            await conn.execute(text(f'VACUUM ANALYZE {schema}."group"'))
+            await conn.execute(text(f'VACUUM ANALYZE {schema}.auth_data'))
+
+
+async def explain(engine, statement: str, params: dict) -> dict:
+    async with engine.connect() as conn:
+        # DELETE выполняется по-настоящему, поэтому откатывается
+        async with conn.begin() as transaction:
+            result = await conn.execute(text(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}'), params)
+            await transaction.rollback()
+    plan = result.scalar()
+    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+    return {'nodes': plan_nodes(plan['Plan']), 'ms': plan['Execution Time'],
+            'buffers': plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0)}
+
+
+async def run(args: argparse.Namespace) -> None:
+    engine = create_async_engine(DATABASE_URL)
+    try:
+        await prepare(engine, args.users, args.groups, args.entries)
+        for name, statements in QUERIES.items():
+            print(f'\n{name}')
+            for schema, statement in zip(('old', 'new'), statements):
+                runs = []
+                for _ in range(args.repeat):
+                    user_id = random.randint(1, args.users)
+                    group_id = (user_id - 1) * args.groups + random.randint(1, args.groups)
+                    auth_data_id = (group_id - 1) * args.entries + random.randint(1, args.entries)
+                    runs.append(await explain(engine, statement, {'user_id': user_id, 'group_id': group_id,
+                                                                  'auth_data_id': auth_data_id}))
+                runs.sort(key=lambda item: item['ms'])
+                median = runs[len(runs) // 2]
+                print(f'  {schema}: {median["ms"]:8.3f} ms  buffers={median["buffers"]:<5} '
+                      f'{" -> ".join(median["nodes"])}')
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text('DROP SCHEMA bench_old CASCADE'))
+                await conn.execute(text('DROP SCHEMA bench_new CASCADE'))
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=5, help='групп на пользователя')
+    parser.add_argument('--entries', type=int, default=20, help='паролей в группе')
+    parser.add_argument('--repeat', type=int, default=21, help='запусков каждого запроса, печатается медиана')
+    parser.add_argument('--keep', action='store_true', help='не удалять схемы bench_old/bench_new')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
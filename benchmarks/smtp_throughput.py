@@ -0,0 +1,111 @@
+""" Пропускная способность отправки писем воркером Celery против локального SMTP сервера (aiosmtpd).
+
+Режимы:
+- connect - прежнее поведение send_email: новое SMTP соединение на каждое письмо
+- pool - send_email через постоянные соединения (celery_tasks/mail.py)
+- batch - send_email_batch, пачки по --batch-size писем через одно соединение
+- async - send_email_batch с EMAIL_BACKEND=async: пачки по --batch-size на --concurrency сессий aiosmtplib
+
+    ENV_FILE='.env.test' python benchmarks/smtp_throughput.py --messages 2000
+--server-delay задерживает ответ на DATA (у реальных серверов это десятки миллисекунд): при ней видно,
+что одна сессия ждет сервер, а async держит несколько писем в работе одновременно.
+Задачи вызываются напрямую, без брокера: замеряется только отправка, поэтому batch здесь близок к pool
+(в работе пачка экономит еще и обмен с брокером на каждое письмо). Локальный сервер отвечает мгновенно,
+с реальным SMTP (сеть, TLS) выигрыш от переиспользования соединений больше.
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+from aiosmtpd.controller import Controller  # noqa: E402
+
+from celery_tasks import tasks  # noqa: E402
+from celery_tasks.mail import SMTPPool, AsyncSMTPSender  # noqa: E402
+
+MODES = ('connect', 'pool', 'batch', 'async')
+
+
+class CountingHandler:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.received = 0
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.received += 1
+        return '250 OK'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_messages(count: int) -> list[dict]:
+    return [{'email': f'user{i}@bench.local', 'username': f'user{i}', 'type_token': 'reset_password',
+             'token': f'token{i}'} for i in range(count)]
+
+
+def send_connect(messages: list[dict], host: str, port: int) -> None:
+    for message in messages:
+        email = tasks.get_email_template(email_address=message['email'], username=message['username'],
+                                         type_email=message['type_token'], token=message['token'])
+        with smtplib.SMTP(host, port) as server:
+            server.send_message(email)
+
+
+def send_pool(messages: list[dict], host: str, port: int) -> None:
+    for message in messages:
+        tasks.send_email.run(**message)
+
+
+def send_batch(messages: list[dict], host: str, port: int, batch_size: int) -> None:
+    for start in range(0, len(messages), batch_size):
+        tasks.send_email_batch.run(messages[start:start + batch_size])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10, help='сессий в режиме async')
+    parser.add_argument('--server-delay', type=float, default=0, help='задержка ответа на DATA, мс')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    handler = CountingHandler(delay=args.server_delay / 1000)
+    host, port = '127.0.0.1', free_port()
+    controller = Controller(handler, hostname=host, port=port)
+    controller.start()
+    senders = {'connect': send_connect, 'pool': send_pool,
+               'batch': lambda messages, host, port: send_batch(messages, host, port, args.batch_size),
+               'async': lambda messages, host, port: send_batch(messages, host, port, args.batch_size)}
+    try:
+        for mode in args.modes:
+            if mode == 'async':
+                tasks.email_sender = AsyncSMTPSender(host=host, port=port, concurrency=args.concurrency, retries=0,
+                                                     backoff=0, timeout=10)
+            else:
+                tasks.email_sender = SMTPPool(host=host, port=port, size=1, max_idle=30, timeout=10)
+            messages, received = make_messages(args.messages), handler.received
+            start = time.perf_counter()
+            senders[mode](messages, host, port)
+            elapsed = time.perf_counter() - start
+            assert handler.received - received == args.messages
+            print(f'{mode:<8} messages={args.messages}  elapsed={elapsed:.2f}s  '
+                  f'messages/s={args.messages / elapsed:.1f}  connections={tasks.email_sender.opened}')
+            tasks.email_sender.close()
+    finally:
+        controller.stop()
+
+
+if __name__ == '__main__':
+    main()
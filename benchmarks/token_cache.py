@@ -0,0 +1,55 @@
+""" Сравнение стоимости проверки JWT в get_current_user с кэшем токенов и без него.
+
+Запуск: ENV_FILE='.env.test' python benchmarks/token_cache.py --requests 100000 --reuse 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'api'))
+
+from jose import jwt  # noqa: E402
+
+from config import JWT_SECRET_KEY, JWT_ALGORITHM, JWT_EXPIRE_MINUTES  # noqa: E402
+from auth.utils import AuthHelper, decode_token, token_cache  # noqa: E402
+
+
+def make_requests(count: int, reuse: int) -> list[str]:
+    """ Поток запросов, в котором каждый токен в среднем повторяется reuse раз """
+    tokens = [AuthHelper.create_access_token(data={'sub': f'user{i}'},
+                                             expires_delta=timedelta(minutes=JWT_EXPIRE_MINUTES))
+              for i in range(max(count // reuse, 1))]
+    return [random.choice(tokens) for _ in range(count)]
+
+
+def run(name: str, decode, requests: list[str]) -> float:
+    start = time.perf_counter()
+    for token in requests:
+        decode(token)
+    per_request = (time.perf_counter() - start) / len(requests) * 1e6
+    print(f'{name:<12} {per_request:8.2f} us/request')
+    return per_request
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100_000)
+    parser.add_argument('--reuse', type=int, nargs='+', default=[1, 10, 100, 1000])
+    args = parser.parse_args()
+
+    for reuse in args.reuse:
+        requests = make_requests(args.requests, reuse)
+        print(f'reuse={reuse} tokens={len(set(requests))} requests={len(requests)}')
+        baseline = run('jwt.decode', lambda token: jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM]),
+                       requests)
+        token_cache.clear()
+        token_cache.hits = token_cache.misses = 0
+        cached = run('token_cache', decode_token, requests)
+        print(f'speedup      {baseline / cached:8.2f}x  (hit ratio {token_cache.stats()["hit_ratio"]:.2%})\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
 #!/bin/bash
 
-echo "Sleeping for 30 seconds…"
-sleep 30
+echo "Waiting for Postgres and Redis…"
+python api/health.py --wait "${WAIT_FOR_DEPENDENCIES_TIMEOUT:-60}" || exit 1
 
 echo "Alembic migrations"
 alembic upgrade head
 
+# метрики воркеров gunicorn собираются через общий каталог, файлы прошлого запуска удаляются
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
 cd api
 
 python main.py
\ No newline at end of file
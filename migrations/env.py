@@ -5,6 +5,7 @@ from sqlalchemy import pool
 
 from alembic import context
 import os
+import re
 import sys
 sys.path.append(os.path.join(sys.path[0], 'api'))
 
@@ -39,6 +40,12 @@ target_metadata = metadata
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    # секции auth_data создаются DDL в crypt_password/models.py, в metadata их нет
+    table = object if type_ == 'table' else getattr(object, 'table', None)
+    return not (reflected and table is not None and re.fullmatch(r'auth_data_p\d+', table.name))
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -56,6 +63,7 @@ def run_migrations_offline() -> None:
         url=url,
         target_metadata=target_metadata,
         literal_binds=True,
+        include_object=include_object,
         dialect_opts={"paramstyle": "named"},
     )
 
@@ -78,7 +86,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
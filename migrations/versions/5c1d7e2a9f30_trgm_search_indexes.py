@@ -0,0 +1,33 @@
+"""trgm search indexes
+
+Revision ID: 5c1d7e2a9f30
+Revises: 83bd77050a56
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1d7e2a9f30'
+down_revision = '83bd77050a56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # CONCURRENTLY - не блокировать запись в auth_data на время построения индексов
+    with op.get_context().autocommit_block():
+        op.create_index('ix_auth_data_service_name_trgm', 'auth_data', ['service_name'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'service_name': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+        op.create_index('ix_auth_data_login_trgm', 'auth_data', ['login'], unique=False,
+                        postgresql_using='gin', postgresql_ops={'login': 'gin_trgm_ops'},
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_auth_data_login_trgm', table_name='auth_data', postgresql_using='gin')
+    op.drop_index('ix_auth_data_service_name_trgm', table_name='auth_data', postgresql_using='gin')
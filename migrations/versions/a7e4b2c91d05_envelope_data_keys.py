@@ -0,0 +1,43 @@
+"""envelope data keys
+
+Revision ID: a7e4b2c91d05
+Revises: 5c1d7e2a9f30
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7e4b2c91d05'
+down_revision = '5c1d7e2a9f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('data_key',
+                    sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('wrapped_key', sa.String(length=512), nullable=False),
+                    sa.Column('is_active', sa.Boolean(), server_default='true', nullable=False),
+                    sa.Column('created_at', sa.TIMESTAMP(), nullable=True),
+                    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_data_key_user_active', 'data_key', ['user_id'], unique=True,
+                    postgresql_where=sa.text('is_active'))
+    # nullable колонка без default - только изменение каталога, существующие записи остаются на общем ключе
+    op.add_column('auth_data', sa.Column('key_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('auth_data_key_id_fkey', 'auth_data', 'data_key', ['key_id'], ['id'])
+    with op.get_context().autocommit_block():
+        op.create_index('ix_auth_data_key_id', 'auth_data', ['key_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_auth_data_key_id', table_name='auth_data')
+    op.drop_constraint('auth_data_key_id_fkey', 'auth_data', type_='foreignkey')
+    op.drop_column('auth_data', 'key_id')
+    op.drop_index('ix_data_key_user_active', table_name='data_key', postgresql_where=sa.text('is_active'))
+    op.drop_table('data_key')
@@ -0,0 +1,58 @@
+"""surrogate keys and user-scoped indexes
+
+Revision ID: b8d3e6f21c47
+Revises: a7e4b2c91d05
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8d3e6f21c47'
+down_revision = 'a7e4b2c91d05'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # внешний ключ auth_data держится за уникальность group.id, которая заменяется первичным ключом
+    op.drop_constraint('auth_data_group_id_fkey', 'auth_data', type_='foreignkey')
+
+    # group: первичный ключ (name, user_id) -> id
+    op.drop_constraint('group_pkey', 'group', type_='primary')
+    op.drop_constraint('group_id_key', 'group', type_='unique')
+    op.create_primary_key('group_pkey', 'group', ['id'])
+    op.create_unique_constraint('uq_group_user_name', 'group', ['user_id', 'name'])
+    op.create_unique_constraint('uq_group_user_id', 'group', ['user_id', 'id'])
+
+    # auth_data: владелец группы копируется в запись
+    op.add_column('auth_data', sa.Column('user_id', sa.Integer(), nullable=True))
+    op.execute('UPDATE auth_data SET user_id = "group".user_id FROM "group" WHERE "group".id = auth_data.group_id')
+    op.alter_column('auth_data', 'user_id', nullable=False)
+    op.drop_constraint('auth_data_pkey', 'auth_data', type_='primary')
+    op.drop_constraint('auth_data_id_key', 'auth_data', type_='unique')
+    op.create_primary_key('auth_data_pkey', 'auth_data', ['id'])
+    op.create_unique_constraint('uq_auth_data_group_service_login', 'auth_data', ['group_id', 'service_name', 'login'])
+    op.create_foreign_key('auth_data_group_fkey', 'auth_data', 'group', ['user_id', 'group_id'], ['user_id', 'id'],
+                          ondelete='CASCADE')
+    op.create_index('ix_auth_data_user_id', 'auth_data', ['user_id', 'id'], unique=False,
+                    postgresql_include=['group_id', 'service_name', 'login'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_auth_data_user_id', table_name='auth_data')
+    op.drop_constraint('auth_data_group_fkey', 'auth_data', type_='foreignkey')
+    op.drop_constraint('uq_auth_data_group_service_login', 'auth_data', type_='unique')
+    op.drop_constraint('auth_data_pkey', 'auth_data', type_='primary')
+    op.create_primary_key('auth_data_pkey', 'auth_data', ['service_name', 'login', 'group_id'])
+    op.create_unique_constraint('auth_data_id_key', 'auth_data', ['id'])
+    op.drop_column('auth_data', 'user_id')
+
+    op.drop_constraint('uq_group_user_id', 'group', type_='unique')
+    op.drop_constraint('uq_group_user_name', 'group', type_='unique')
+    op.drop_constraint('group_pkey', 'group', type_='primary')
+    op.create_primary_key('group_pkey', 'group', ['name', 'user_id'])
+    op.create_unique_constraint('group_id_key', 'group', ['id'])
+    op.create_foreign_key('auth_data_group_id_fkey', 'auth_data', 'group', ['group_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,132 @@
+"""hash-partition auth_data by user_id
+
+Revision ID: c3f9a8d5e217
+Revises: b8d3e6f21c47
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f9a8d5e217'
+down_revision = 'b8d3e6f21c47'
+branch_labels = None
+depends_on = None
+
+# значение AUTH_DATA_PARTITIONS из crypt_password/models.py на момент миграции
+PARTITIONS = 16
+BATCH_SIZE = 10000
+COLUMNS = 'id, user_id, service_name, login, hashed_password, group_id, key_id'
+# индексы новой таблицы создаются под временными именами, пока старые заняты auth_data
+INDEXES = ('ix_auth_data_user_id', 'ix_auth_data_key_id', 'ix_auth_data_service_name_trgm', 'ix_auth_data_login_trgm')
+
+# пока идет копирование, изменения старой таблицы повторяются в новой
+SYNC_FUNCTION = f"""
+CREATE FUNCTION auth_data_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM auth_data_new WHERE user_id = OLD.user_id AND id = OLD.id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO auth_data_new ({COLUMNS})
+            VALUES (NEW.id, NEW.user_id, NEW.service_name, NEW.login, NEW.hashed_password, NEW.group_id, NEW.key_id)
+            ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+
+def create_indexes(table: str, suffix: str = '') -> None:
+    op.create_index(f'ix_auth_data_user_id{suffix}', table, ['user_id', 'id'], unique=False,
+                    postgresql_include=['group_id', 'service_name', 'login'])
+    op.create_index(f'ix_auth_data_key_id{suffix}', table, ['key_id'], unique=False)
+    op.create_index(f'ix_auth_data_service_name_trgm{suffix}', table, ['service_name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'service_name': 'gin_trgm_ops'})
+    op.create_index(f'ix_auth_data_login_trgm{suffix}', table, ['login'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'login': 'gin_trgm_ops'})
+
+
+def upgrade() -> None:
+    # 1. секционированная таблица рядом со старой, индексы на пустых секциях создаются мгновенно
+    op.create_table('auth_data_new',
+                    sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('service_name', sa.String(length=512), nullable=False),
+                    sa.Column('login', sa.String(length=128), nullable=False),
+                    sa.Column('hashed_password', sa.String(length=2048), nullable=False),
+                    sa.Column('group_id', sa.Integer(), nullable=False),
+                    sa.Column('key_id', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('user_id', 'id', name='auth_data_new_pkey'),
+                    sa.ForeignKeyConstraint(['user_id', 'group_id'], ['group.user_id', 'group.id'], ondelete='CASCADE',
+                                            name='auth_data_group_fkey'),
+                    sa.ForeignKeyConstraint(['key_id'], ['data_key.id'], name='auth_data_key_id_fkey'),
+                    sa.UniqueConstraint('user_id', 'group_id', 'service_name', 'login',
+                                        name='uq_auth_data_new_group_service_login'),
+                    postgresql_partition_by='HASH (user_id)',
+                    )
+    for remainder in range(PARTITIONS):
+        op.execute(f'CREATE TABLE auth_data_p{remainder} PARTITION OF auth_data_new '
+                   f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})')
+    create_indexes('auth_data_new', suffix='_new')
+    op.execute(SYNC_FUNCTION)
+    op.execute('CREATE TRIGGER auth_data_sync AFTER INSERT OR UPDATE OR DELETE ON auth_data '
+               'FOR EACH ROW EXECUTE FUNCTION auth_data_sync()')
+
+    # 2. копирование пачками по id, каждая в своей транзакции: сервис продолжает писать в auth_data.
+    # Все записи с id больше max(id) появились уже с триггером. FOR SHARE ждет незавершенные изменения
+    # строк пачки, чтобы удаленная или измененная параллельно запись не попала в копию в старом виде
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.execute(sa.text('SELECT coalesce(max(id), 0) FROM auth_data')).scalar()
+        for start in range(0, max_id, BATCH_SIZE):
+            bind.execute(sa.text(f'INSERT INTO auth_data_new ({COLUMNS}) SELECT {COLUMNS} FROM auth_data '
+                                 f'WHERE id > :start AND id <= :end FOR SHARE ON CONFLICT DO NOTHING'),
+                         {'start': start, 'end': start + BATCH_SIZE})
+
+    # 3. подмена таблиц - короткая блокировка без копирования данных
+    op.execute('LOCK TABLE auth_data IN ACCESS EXCLUSIVE MODE')
+    op.execute('DROP TRIGGER auth_data_sync ON auth_data')
+    op.execute('DROP FUNCTION auth_data_sync()')
+    op.drop_table('auth_data')
+    op.rename_table('auth_data_new', 'auth_data')
+    op.execute('ALTER SEQUENCE auth_data_new_id_seq RENAME TO auth_data_id_seq')
+    op.execute('ALTER TABLE auth_data RENAME CONSTRAINT auth_data_new_pkey TO auth_data_pkey')
+    op.execute('ALTER TABLE auth_data RENAME CONSTRAINT uq_auth_data_new_group_service_login '
+               'TO uq_auth_data_group_service_login')
+    for name in INDEXES:
+        op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+    # записи копировались с явным id, счетчик identity новой таблицы продолжает старый
+    op.execute("SELECT setval('auth_data_id_seq', coalesce(max(id), 0) + 1, false) FROM auth_data")
+
+
+def downgrade() -> None:
+    # обратный путь без копирования онлайн: auth_data заблокирована на время переноса
+    op.create_table('auth_data_old',
+                    sa.Column('id', sa.Integer(), sa.Identity(always=False), nullable=False),
+                    sa.Column('user_id', sa.Integer(), nullable=False),
+                    sa.Column('service_name', sa.String(length=512), nullable=False),
+                    sa.Column('login', sa.String(length=128), nullable=False),
+                    sa.Column('hashed_password', sa.String(length=2048), nullable=False),
+                    sa.Column('group_id', sa.Integer(), nullable=False),
+                    sa.Column('key_id', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('id', name='auth_data_old_pkey'),
+                    sa.ForeignKeyConstraint(['user_id', 'group_id'], ['group.user_id', 'group.id'], ondelete='CASCADE',
+                                            name='auth_data_group_fkey'),
+                    sa.ForeignKeyConstraint(['key_id'], ['data_key.id'], name='auth_data_key_id_fkey'),
+                    sa.UniqueConstraint('group_id', 'service_name', 'login',
+                                        name='uq_auth_data_old_group_service_login'),
+                    )
+    op.execute('LOCK TABLE auth_data IN ACCESS EXCLUSIVE MODE')
+    op.execute(f'INSERT INTO auth_data_old ({COLUMNS}) SELECT {COLUMNS} FROM auth_data')
+    op.drop_table('auth_data')
+    op.rename_table('auth_data_old', 'auth_data')
+    op.execute('ALTER SEQUENCE auth_data_old_id_seq RENAME TO auth_data_id_seq')
+    op.execute('ALTER TABLE auth_data RENAME CONSTRAINT auth_data_old_pkey TO auth_data_pkey')
+    op.execute('ALTER TABLE auth_data RENAME CONSTRAINT uq_auth_data_old_group_service_login '
+               'TO uq_auth_data_group_service_login')
+    create_indexes('auth_data')
+    op.execute("SELECT setval('auth_data_id_seq', coalesce(max(id), 0) + 1, false) FROM auth_data")
@@ -0,0 +1,26 @@
+"""data_key retired_at
+
+Revision ID: d4a7c2e9b813
+Revises: c3f9a8d5e217
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4a7c2e9b813'
+down_revision = 'c3f9a8d5e217'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('data_key', sa.Column('retired_at', sa.TIMESTAMP(), nullable=True))
+    # время вывода уже выведенных ключей неизвестно - отсчет с миграции
+    op.execute("UPDATE data_key SET retired_at = now() AT TIME ZONE 'utc' WHERE NOT is_active")
+
+
+def downgrade() -> None:
+    op.drop_column('data_key', 'retired_at')
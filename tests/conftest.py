@@ -3,6 +3,7 @@ from typing import AsyncGenerator
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import NullPool
@@ -48,3 +49,16 @@ def event_loop(request):
 async def ac() -> AsyncGenerator[AsyncClient, None]:
     async with AsyncClient(app=app, base_url="http://test") as ac:
         yield ac
+
+
+@pytest.fixture
+def query_counter() -> list:
+    """ Список SQL запросов, выполненных через тестовый engine за время теста """
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(engine_test.sync_engine, 'before_cursor_execute', before_cursor_execute)
+    yield queries
+    event.remove(engine_test.sync_engine, 'before_cursor_execute', before_cursor_execute)
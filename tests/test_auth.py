@@ -1,4 +1,20 @@
+import asyncio
+import uuid
+from datetime import timedelta
+
+from fastapi import HTTPException
 from httpx import AsyncClient
+from passlib.context import CryptContext
+from redis.asyncio import Redis
+from sqlalchemy import select, update
+
+from auth import endpoints
+from auth.hashing import PasswordHasher, pwd_context
+from auth.models import user as user_model
+from auth.rate_limit import RateLimiter
+from auth.utils import AuthHelper, decode_token, token_cache
+from config import REDIS_HOST, REDIS_PORT, RATE_LIMIT_DB
+from conftest import async_session_maker
 
 global auth_token
 
@@ -51,6 +67,12 @@ async def test_get_user_info_by_username(ac: AsyncClient):
     assert response.json()["username"] == 'admin1'
 
 
+async def test_cached_user_invalidated_after_update(ac: AsyncClient):
+    # токен выписан на старый username, закэшированная строка должна быть сброшена
+    response = await ac.get("/auth/my_user", headers={'Authorization': auth_token})
+    assert response.status_code == 401
+
+
 async def test_reset_password(ac: AsyncClient):
     response = await ac.post("/auth/reset_password/", json={
         "email": "test@mail.ru"
@@ -73,3 +95,55 @@ async def test_reset_password(ac: AsyncClient):
 #                              json={"new_password": "UYGYUGdsdf&43", "old_password": "Stygf11134&43"})
 #     assert response.status_code == 200
 #     assert response.json()["message"] == 'Password by username (admin1) successfully updated.'
+
+
+async def test_password_hasher_overflow():
+    hasher = PasswordHasher(workers=1, max_pending=1)
+    hashed = await hasher.hash('Admin1$3adsfas')
+    assert await hasher.verify('Admin1$3adsfas', hashed) is True
+
+    results = await asyncio.gather(hasher.hash('Admin1$3adsfas'), hasher.hash('Admin1$3adsfas'),
+                                   return_exceptions=True)
+    errors = [result for result in results if isinstance(result, HTTPException)]
+    assert len(errors) == 1 and errors[0].status_code == 503
+    hasher.shutdown()
+
+
+async def test_token_cache_reuses_claims():
+    token = AuthHelper.create_access_token(data={'sub': 'cached'}, expires_delta=timedelta(minutes=1))
+    hits = token_cache.hits
+    assert decode_token(token)['sub'] == 'cached'
+    assert decode_token(token)['sub'] == 'cached'
+    assert token_cache.hits == hits + 1
+
+
+async def test_login_rehashes_outdated_password(ac: AsyncClient):
+    # хэш с меньшей стоимостью, чем в настройках, заменяется при успешном входе
+    outdated = CryptContext(schemes=['bcrypt'], bcrypt__rounds=4).hash('Admin1$3adsfas')
+    async with async_session_maker() as session:
+        await session.execute(update(user_model).where(user_model.c.username == 'admin1').values(password=outdated))
+        await session.commit()
+
+    response = await ac.post("/auth/login", data={"username": "admin1", "password": "Admin1$3adsfas"})
+    assert response.status_code == 200
+
+    async with async_session_maker() as session:
+        stored = await session.scalar(select(user_model.c.password).where(user_model.c.username == 'admin1'))
+    assert stored != outdated
+    assert pwd_context.verify('Admin1$3adsfas', stored) and not pwd_context.needs_update(stored)
+
+
+async def test_login_rate_limit(ac: AsyncClient, monkeypatch):
+    client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=RATE_LIMIT_DB)
+    limiter = RateLimiter(f'test_login_{uuid.uuid4().hex}', client, {'user': '2/60', 'ip': '100/60'})
+    monkeypatch.setattr(endpoints, 'login_limiter', limiter)
+
+    statuses = [(await ac.post("/auth/login", data={"username": "admin1", "password": "Wrong1$password"})).status_code
+                for _ in range(3)]
+    assert statuses == [401, 401, 429]
+    response = await ac.post("/auth/login", data={"username": "admin1", "password": "Admin1$3adsfas"})
+    assert response.status_code == 429 and int(response.headers['Retry-After']) > 0
+    # корзина другого пользователя не затронута
+    response = await ac.post("/auth/login", data={"username": "nobody", "password": "Wrong1$password"})
+    assert response.status_code == 401
+    await client.close()
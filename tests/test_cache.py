@@ -0,0 +1,60 @@
+import uuid
+
+from redis.asyncio import Redis
+
+from cache import RedisCache, TTLCache
+from config import REDIS_HOST, REDIS_PORT, REDIS_CACHE_DB
+
+
+def make_cache(client: Redis, name: str) -> RedisCache:
+    return RedisCache(name=name, client=client, ttl=60, local=TTLCache(name=name, maxsize=16, ttl=60))
+
+
+async def test_redis_cache_invalidation_between_instances():
+    client = Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_CACHE_DB)
+    name = f'test_{uuid.uuid4().hex}'
+    # два процесса: общий Redis, у каждого свой локальный кэш
+    first, second = make_cache(client, name), make_cache(client, name)
+    db = {'k': 'old'}
+    loads = []
+
+    async def load():
+        loads.append(db['k'])
+        return db['k']
+
+    assert await first.get_or_load('k', load) == 'old'
+    assert await second.get_or_load('k', load) == 'old'
+    assert loads == ['old']
+
+    db['k'] = 'new'
+    await first.invalidate('k')
+    assert await second.get_or_load('k', load) == 'new'
+    assert await first.get_or_load('k', load) == 'new'
+
+    # истекшая версия не должна снова выдать значение, записанное под ней когда-то
+    await first.invalidate('k')
+    db['k'] = 'stale'
+    assert await first.get_or_load('k', load) == 'stale'
+    await client.delete(first._version_key('k'))
+    db['k'] = 'fresh'
+    await first.invalidate('k')
+    assert await second.get_or_load('k', load) == 'fresh'
+
+    await client.delete(*await client.keys(f'{name}:*'))
+    await client.close()
+
+
+async def test_redis_cache_unavailable():
+    client = Redis(host=REDIS_HOST, port=1, socket_connect_timeout=1)
+    cache = make_cache(client, f'test_{uuid.uuid4().hex}')
+    loads = []
+
+    async def load():
+        loads.append(1)
+        return 'value'
+
+    assert await cache.get_or_load('k', load) == 'value'
+    assert await cache.get_or_load('k', load) == 'value'
+    assert len(loads) == 2
+    await cache.invalidate('k')
+    await client.close()
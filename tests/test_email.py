@@ -0,0 +1,94 @@
+import json
+import socket
+import uuid
+
+import pytest
+from aiosmtpd.controller import Controller
+
+from celery_tasks import tasks, mail
+from celery_tasks.mail import SMTPPool, AsyncSMTPSender
+
+
+class CollectingHandler:
+    """ bounce* - постоянный отказ (550), retry* - временная ошибка (451) на первую попытку """
+
+    def __init__(self):
+        self.recipients = []
+        self.deferred = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options) -> str:
+        if address.startswith('bounce'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope) -> str:
+        address = envelope.rcpt_tos[0]
+        if address.startswith('retry') and address not in self.deferred:
+            self.deferred.add(address)
+            return '451 Try again later'
+        self.recipients.extend(envelope.rcpt_tos)
+        return '250 OK'
+
+
+@pytest.fixture
+def smtp_server():
+    """ Локальный SMTP сервер, restart() обрывает открытые к нему соединения """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    handler = CollectingHandler()
+    controllers = [Controller(handler, hostname='127.0.0.1', port=port)]
+    controllers[0].start()
+
+    def restart() -> None:
+        controllers[0].stop()
+        controllers[0] = Controller(handler, hostname='127.0.0.1', port=port)
+        controllers[0].start()
+
+    yield port, handler, restart
+    controllers[0].stop()
+
+
+def make_message(number: int) -> dict:
+    return {'email': f'user{number}@mail.ru', 'username': f'user{number}', 'type_token': 'reset_password',
+            'token': 'token'}
+
+
+def test_send_email_reuses_connection(smtp_server, monkeypatch):
+    port, handler, restart = smtp_server
+    pool = SMTPPool(host='127.0.0.1', port=port, size=1, max_idle=30, timeout=5)
+    monkeypatch.setattr(tasks, 'email_sender', pool)
+
+    tasks.send_email.run(**make_message(1))
+    assert tasks.send_email_batch.run([make_message(2), make_message(3)]) == []
+    assert handler.recipients == ['user1@mail.ru', 'user2@mail.ru', 'user3@mail.ru']
+    assert pool.opened == 1
+    assert tasks.get_content_html.cache_info().hits >= 2
+
+    # сервер перезапущен, соединение в пуле оборвано: письмо уходит через новое
+    restart()
+    tasks.send_email.run(**make_message(4))
+    assert handler.recipients[-1] == 'user4@mail.ru'
+    assert pool.opened == 2
+    pool.close()
+
+
+def test_async_sender_retries_and_dead_letters(smtp_server, monkeypatch):
+    port, handler, _ = smtp_server
+    dead_letter_key = f'test:dead_letter:{uuid.uuid4().hex}'
+    monkeypatch.setattr(mail, 'EMAIL_DEAD_LETTER_KEY', dead_letter_key)
+    sender = AsyncSMTPSender(host='127.0.0.1', port=port, concurrency=4, retries=2, backoff=0.01, timeout=5)
+    monkeypatch.setattr(tasks, 'email_sender', sender)
+
+    messages = [make_message(number) for number in range(20)]
+    messages[3]['email'], messages[7]['email'] = 'retry@mail.ru', 'bounce@mail.ru'
+    assert tasks.send_email_batch.run(messages) == ['bounce@mail.ru']
+    assert len(handler.recipients) == 19 and 'retry@mail.ru' in handler.recipients
+    assert sender.opened <= 4 + 2  # сессии плюс переподключение после каждой ошибки
+
+    entries = [json.loads(entry) for entry in mail.redis_client.lrange(dead_letter_key, 0, -1)]
+    assert [entry['to'] for entry in entries] == ['bounce@mail.ru']
+    assert entries[0]['error'] == '550 No such user'
+    mail.redis_client.delete(dead_letter_key)
+    sender.close()
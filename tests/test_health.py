@@ -0,0 +1,28 @@
+from httpx import AsyncClient
+from redis.asyncio import Redis
+
+import health
+from database import engine
+
+
+async def test_health(ac: AsyncClient, monkeypatch):
+    response = await ac.get('/health/live')
+    assert response.status_code == 200
+
+    # воркер еще не прогрет - трафик на него не идет
+    monkeypatch.setattr(health, '_warmed_up', False)
+    response = await ac.get('/health/ready')
+    assert response.status_code == 503
+    assert response.json()['checks'] == {'postgres': 'ok', 'redis': 'ok'}
+
+    await health.warm_up(connections=3)
+    assert engine.sync_engine.pool.checkedin() >= 3
+    response = await ac.get('/health/ready')
+    assert response.status_code == 200, response.json()
+
+    monkeypatch.setattr(health, 'redis_client', Redis(host='localhost', port=1, socket_connect_timeout=1))
+    response = await ac.get('/health/ready')
+    assert response.status_code == 503
+    assert response.json()['checks']['postgres'] == 'ok'
+    assert response.json()['checks']['redis'] != 'ok'
+    await engine.dispose()